@@ -0,0 +1,61 @@
+"""
+Compares the vectorized fan.get_assoc_mat with the former implementation that
+looped over every (cue, target, strength) tuple in Python.
+
+Needs the FAN database created by create_database.py.
+"""
+
+from __future__ import print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from cogsci17_semflu import fan
+
+path = os.path.join(
+    os.path.dirname(__file__), os.pardir, 'association_data')
+
+animals_path = os.path.join(
+    os.path.dirname(__file__), os.pardir, 'animal_data', 'animal_words.txt')
+
+
+def get_assoc_mat_loop(words, association_db, usewords=None):
+    """Reference implementation, one Python iteration per association."""
+    if usewords is None:
+        usewords = list(words)
+
+    w2i = {w: i for i, w in enumerate(usewords)}
+
+    assoc_mat = np.zeros((len(w2i), len(w2i)))
+    for cue, target, strength in association_db:
+        if usewords is words or cue in usewords and target in usewords:
+            assoc_mat[w2i[cue], w2i[target]] = strength
+    return assoc_mat
+
+
+def best_of(f, repeat):
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+
+if __name__ == '__main__':
+    words, assoc_db = fan.load_assoc_db(os.path.join(path, 'fan_db.pkl'))
+    animal_words = [
+        w.upper().strip() for w in open(animals_path, 'r').readlines()]
+    animal_words = [w for w in animal_words if w in words] + ['ANIMAL']
+
+    for label, usewords, repeat in [
+            ('{} animal words'.format(len(animal_words)), animal_words, 5),
+            ('{} words (full FAN)'.format(len(words)), sorted(words), 1)]:
+        expected = get_assoc_mat_loop(words, assoc_db, usewords)
+        actual, _, _ = fan.get_assoc_mat(words, assoc_db, usewords=usewords)
+        assert np.array_equal(expected, actual), "Matrices differ."
+
+        t_loop = best_of(
+            lambda: get_assoc_mat_loop(words, assoc_db, usewords), repeat)
+        t_vec = best_of(
+            lambda: fan.get_assoc_mat(words, assoc_db, usewords=usewords),
+            repeat)
+        print('{}: loop {:.3f}s, vectorized {:.3f}s, speedup {:.1f}x'.format(
+            label, t_loop, t_vec, t_loop/t_vec))
@@ -0,0 +1,60 @@
+"""
+Checks the dynamic programming segmentation used by
+process_responses.get_category_switches against the former exhaustive search
+(cat_mat_sol) on short random response sequences and times it on long ones.
+
+Needs the animal categories created by scripts/categorize_animals.py.
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import numpy as np
+
+from cogsci17_semflu import process_responses as pr
+
+
+def exhaustive_segmentation(cat_matrix):
+    """Reference implementation, scores every segmentation of cat_mat_sol."""
+    solutions = pr.cat_mat_sol(0, np.zeros(cat_matrix.shape), cat_matrix)
+
+    best_val = 0
+    best_index = -1
+    for i, s in enumerate(solutions):
+        score = (s.shape[0] - np.count_nonzero(np.sum(s, axis=1)))*1000000 \
+            + np.sum(s)
+        if score > best_val:
+            best_val = score
+            best_index = i
+    return solutions[best_index]
+
+
+def random_sequence(length, rng=np.random):
+    _, animal_to_category = pr.animal_categories()
+    animals = sorted(animal_to_category.keys())
+    return list(rng.choice(animals, length, replace=False))
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    category_to_animal, animal_to_category = pr.animal_categories()
+
+    for length in range(1, 9):
+        for _ in range(50):
+            cat_matrix = pr.build_categorization_matrix(
+                random_sequence(length, rng), animal_to_category,
+                category_to_animal)
+            assert np.array_equal(
+                exhaustive_segmentation(cat_matrix),
+                pr.optimal_segmentation(cat_matrix)), "Segmentations differ."
+    print('Same segmentation as the exhaustive search on 400 sequences.')
+
+    for length in [8, 36, 100]:
+        sequences = [random_sequence(length, rng) for _ in range(20)]
+        t = min(timeit.repeat(lambda: [
+            pr.get_category_switches(
+                s, animal_to_category, category_to_animal)
+            for s in sequences], number=1, repeat=3))
+        print('{} responses: {:.2f}ms per sequence'.format(
+            length, 1000*t/len(sequences)))
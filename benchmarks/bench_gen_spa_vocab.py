@@ -0,0 +1,48 @@
+"""
+Checks that fan.gen_spa_vocab creates the same vectors as parsing the words
+with spa.Vocabulary (as it did before) and times both for vocabularies of up
+to 5018 words.
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import numpy as np
+from nengo import spa
+
+from cogsci17_semflu import fan
+
+
+def parse_vocab(dimensions, word_list, rng, max_similarity=0.1):
+    """Reference implementation, parses the sum of all words."""
+    vocab = spa.Vocabulary(dimensions, rng=rng, max_similarity=max_similarity)
+    vocab.parse('+'.join(word_list))
+    return vocab
+
+
+def words(n):
+    return ['W{}'.format(i) for i in range(n)]
+
+
+if __name__ == '__main__':
+    for n, d, max_similarity in [(157, 64, 0.1), (157, 256, 0.1),
+                                 (500, 256, 0.1), (5018, 256, 1.)]:
+        ref = parse_vocab(d, words(n), np.random.RandomState(0), max_similarity)
+        vocab = fan.gen_spa_vocab(
+            d, words(n), np.random.RandomState(0), max_similarity)
+        assert ref.keys == vocab.keys, "Keys differ."
+        assert np.array_equal(ref.vectors, vocab.vectors), "Vectors differ."
+    print('Same vocabularies as spa.Vocabulary.parse.')
+
+    for n, d, max_similarity in [(157, 256, 0.1), (5018, 256, 1.),
+                                 (5018, 512, 1.)]:
+        for name, f in [('parse', parse_vocab), ('bulk', fan.gen_spa_vocab)]:
+            if name == 'parse' and n > 1000:
+                continue  # takes minutes
+            t = min(timeit.repeat(
+                lambda: f(d, words(n), np.random.RandomState(0),
+                          max_similarity=max_similarity),
+                number=1, repeat=3))
+            print('{:>5} {:5} words, d={}, max_similarity={}: {:.1f}ms'.format(
+                name, n, d, max_similarity, 1000*t))
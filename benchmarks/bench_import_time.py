@@ -0,0 +1,67 @@
+"""
+Times the import of every module of the package, each in a fresh interpreter.
+
+Importing a module should not load association data or nengo unless the module
+itself needs them (e.g. wta_semflu); this is what keeps the command line tools
+and worker processes quick to start. The time of starting the interpreter is
+subtracted.
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import timeit
+
+models_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'cogsci17_semflu',
+    'models')
+
+modules = [
+    'cogsci17_semflu.cache',
+    'cogsci17_semflu.spikes',
+    'cogsci17_semflu.fan',
+    'cogsci17_semflu.process_responses',
+    'process_output',
+    'sweep',
+    'wta_semflu',
+]
+
+
+def import_time(module, repeat=5):
+    """Returns the best wall time in seconds of importing `module` in a new
+    interpreter, including the start of the interpreter."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [models_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    cmd = [sys.executable, '-c', 'import ' + module if module else 'pass']
+    with open(os.devnull, 'w') as devnull:
+        return min(timeit.repeat(
+            lambda: subprocess.check_call(cmd, env=env, stderr=devnull),
+            number=1, repeat=repeat))
+
+
+def loaded_modules(module):
+    """Returns which of the heavy dependencies are loaded by importing
+    `module`."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [models_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    code = ('import sys; import {}; print(" ".join(m for m in '
+            '("nengo", "pytry", "pandas", "scipy") if m in sys.modules))')
+    return subprocess.check_output(
+        [sys.executable, '-c', code.format(module)], env=env).decode().strip()
+
+
+if __name__ == '__main__':
+    startup = import_time('')
+    print('Interpreter start: {:.1f}ms'.format(1000*startup))
+    for module in modules:
+        try:
+            t = import_time(module)
+        except subprocess.CalledProcessError:
+            print('{:<40} failed (missing dependency?)'.format(module))
+            continue
+        print('{:<40} {:7.1f}ms   loads: {}'.format(
+            module, 1000*(t - startup), loaded_modules(module)))
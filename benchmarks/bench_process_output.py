@@ -0,0 +1,101 @@
+"""
+Compares the columnar models/process_output.responses_to_output with the
+former implementation that appended every recalled animal to the output
+DataFrame.
+
+Needs the animal categories created by scripts/categorize_animals.py.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(__file__), os.pardir, 'cogsci17_semflu', 'models'))
+
+from cogsci17_semflu.process_responses import (
+    animal_categories, get_category_switches_heuristic)
+from process_output import columns, responses_to_output
+
+
+def responses_to_output_loop(df, nr_samp=30):
+    """Reference implementation, one DataFrame.append per recalled animal."""
+    output = pd.DataFrame(columns=columns)
+
+    for row_idx, row in df.iterrows():
+        patch_num = 1
+        responses = row.responses[:nr_samp]
+        irts_row = row.irt[:nr_samp]
+        t_cl, animals = get_category_switches_heuristic(responses, irts_row)
+
+        counter = 0
+        for ai, (a_c, t_c) in enumerate(zip(animals, t_cl)):
+            for cai, animal in enumerate(a_c):
+                counter += 1
+
+                last = 0
+                if animal == a_c[-1]:
+                    last = 1
+
+                fromend = len(a_c)-cai
+                irt = t_c[cai]
+
+                output = output.append([{'entry': animal, 'sid': int(row.seed),
+                                         'fpatchnum': patch_num,
+                                         'fpatchitem': cai+1,
+                                         'fitemsfromend': fromend,
+                                         'flastitem': last,
+                                         'catitem': counter,
+                                         'irt': irt, 'meanirt': 1}],
+                                       ignore_index=True)
+            patch_num += 1
+
+    output['flastitem'] = output['flastitem'].apply(int)
+    output['irt'] = output['irt'].apply(int)
+    output['sid'] = output['sid'].apply(int)
+
+    mean_irt = output.groupby('sid').mean().irt
+    for sid, mirt in mean_irt.iteritems():
+        output.set_value(output.sid == sid, 'meanirt', mirt)
+
+    return output
+
+
+def synthetic_simulations(n_seeds, n_resp=36, rng=np.random):
+    """Random response sequences in the format returned by SemFlu."""
+    _, animal_to_category = animal_categories()
+    animals = sorted(animal_to_category.keys())
+    return pd.DataFrame({
+        'seed': np.arange(n_seeds),
+        'responses': [
+            list(rng.choice(animals, n_resp, replace=False))
+            for _ in range(n_seeds)],
+        'irt': [list(rng.gamma(2., 500., n_resp)) for _ in range(n_seeds)],
+    })
+
+
+def best_of(f, repeat):
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    for n_seeds in [141, 1000]:
+        df = synthetic_simulations(n_seeds, rng=rng)
+
+        expected = responses_to_output_loop(df, 36)
+        actual = responses_to_output(df, 36)
+        for c in columns:
+            assert np.array_equal(
+                expected[c].values.astype(actual[c].dtype), actual[c].values
+            ), "Column {} differs.".format(c)
+
+        t_loop = best_of(lambda: responses_to_output_loop(df, 36), 1)
+        t_col = best_of(lambda: responses_to_output(df, 36), 3)
+        print('{} seeds: append {:.3f}s, columnar {:.3f}s, '
+              'speedup {:.1f}x'.format(n_seeds, t_loop, t_col, t_loop/t_col))
@@ -0,0 +1,84 @@
+"""
+Times the computation of the cue to state transform of SemFlu for growing
+vocabularies, from a dense association matrix, a sparse one and low-rank
+approximations of it, and reports the error of the approximations. For the
+low-rank approximations, the decomposition (done once per model) and the
+transform (done for every seed) are timed separately.
+
+Uses the full FAN matrix (``create_database.py fan_full_mat``) if it has been
+created and a random sparse matrix with the same density otherwise.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import timeit
+
+import numpy as np
+import scipy.sparse
+
+from cogsci17_semflu import fan
+
+data_path = os.path.join(
+    os.path.dirname(__file__), os.pardir, 'association_data')
+
+
+def random_assoc_mat(n, per_row=13, rng=np.random):
+    """Row normalized sparse matrix with `per_row` associates per word, where
+    some words are much more popular targets than others (like in FAN)."""
+    popularity = rng.pareto(1., n) + 1.
+    popularity /= np.sum(popularity)
+    rows = np.repeat(np.arange(n), per_row)
+    cols = rng.choice(n, n*per_row, p=popularity)
+    mat = scipy.sparse.csr_matrix(
+        (rng.rand(n*per_row), (rows, cols)), shape=(n, n))
+    mat.setdiag(0)
+    return fan.normalize_sparse_rows(mat)
+
+
+def best_time(f, repeat=3):
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--d', type=int, default=256)
+    parser.add_argument('--ranks', type=int, nargs='*', default=[50, 100, 200])
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    if os.path.exists(fan.assoc_mat_file(data_path, 'fan_full_mat')):
+        assoc_mat, _, _ = fan.load_assoc_mat(data_path, 'fan_full_mat')
+        print('FAN matrix of', assoc_mat.shape[0], 'words')
+    else:
+        assoc_mat = random_assoc_mat(5018, rng=rng)
+        print('Random matrix of', assoc_mat.shape[0], 'words')
+
+    print('{:>5} {:>10} {:>10} {:>6} {:>10} {:>10} {:>8} {:>8}'.format(
+        'words', 'dense', 'sparse', 'rank', 'svd', 'low-rank', 'mat err',
+        'tr err'))
+    for n in [157, 500, 1000, 2500, assoc_mat.shape[0]]:
+        mat = assoc_mat[:n][:, :n].tocsr()
+        dense = mat.toarray()
+        vectors = fan.random_pointers(n, args.d, rng, max_similarity=1.)
+
+        t_dense = best_time(lambda: fan.assoc_transform(vectors, dense))
+        t_sparse = best_time(lambda: fan.assoc_transform(vectors, mat))
+        tr = fan.assoc_transform(vectors, mat)
+        assert np.allclose(tr, fan.assoc_transform(vectors, dense))
+
+        for rank in args.ranks:
+            if rank >= n:
+                continue
+
+            t_svd = best_time(lambda: fan.low_rank_assoc(mat, rank), repeat=1)
+            u, s, vt, error = fan.low_rank_assoc(mat, rank)
+            t_low = best_time(
+                lambda: fan.low_rank_transform(vectors, u, s, vt))
+            tr_error = (np.linalg.norm(
+                tr - fan.low_rank_transform(vectors, u, s, vt)) /
+                np.linalg.norm(tr))
+            print('{:5} {:9.1f}ms {:9.1f}ms {:6} {:9.1f}ms {:9.1f}ms {:8.3f} '
+                  '{:8.3f}'.format(n, 1000*t_dense, 1000*t_sparse, rank,
+                                   1000*t_svd, 1000*t_low, error, tr_error))
@@ -0,0 +1,121 @@
+"""
+Compares decoding the responses of SemFlu every few timesteps and in single
+precision (the sample_every and decode_float32 parameters) with decoding every
+timestep in double precision.
+
+Decimation delays responses, but not only by up to ``sample_every - 1``
+timesteps: the noisy similarity of a word can drop below the threshold of the
+decoder again after first exceeding it, and words that are the best match for
+only a few timesteps can be missed. So the differences are measured. For every
+setting the fraction of seeds with the same responses is reported, and for
+these seeds the median, the `--percentile` percentile and the maximum of the
+differences of the IRTs (and the time of the first response). The check fails
+if fewer than `--min-same` of the seeds have the same responses or the
+percentile exceeds `--tolerance` ms. In one run on a small association matrix
+the largest difference was 5 ms for ``sample_every=2`` and 12 ms for
+``sample_every=5``.
+
+Every seed is simulated once with decoders for all settings connected to its
+response state, the decoder of the model itself (every timestep, float64)
+being the reference. Needs nengo and the association matrix (see README.md):
+
+    python check_response_decimation.py --seeds 20 --sample-every 2 5 10 \
+        --tolerance 10 --percentile 95
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import nengo
+import numpy as np
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(__file__), os.pardir, 'cogsci17_semflu', 'models'))
+
+from wta_semflu import ResponseDecoder, SemFlu
+
+
+def simulate(seed, settings, **params):
+    """Simulates a seed and returns the reference decoder and a decoder for
+    every (sample_every, dtype) in `settings`."""
+    trial = SemFlu()
+    model = trial.make_model(seed=seed, **params)
+    decoders = []
+    with model:
+        for sample_every, dtype in settings:
+            decoder = ResponseDecoder(
+                trial.vocab, sample_every=sample_every, dtype=dtype,
+                dt=params['dt'])
+            node = nengo.Node(decoder, size_in=params['d'])
+            nengo.Connection(model.response.output, node, synapse=0.03)
+            decoders.append(decoder)
+
+    with nengo.Simulator(model, dt=params['dt'], progress_bar=False) as sim:
+        sim.run(params['sim_len'])
+    return trial.decoder, decoders
+
+
+def irt_differences(reference, decoder):
+    """Differences of the IRTs of every response in ms (None if the responses
+    differ)."""
+    if reference.responses != decoder.responses:
+        return None
+    return np.abs(np.subtract(reference.irt, decoder.irt))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seeds', type=int, default=20)
+    parser.add_argument('--seed-start', type=int, default=0)
+    parser.add_argument('--sample-every', type=int, nargs='*',
+                        default=[1, 2, 5, 10])
+    parser.add_argument('--d', type=int, default=256)
+    parser.add_argument('--amat', type=str, default='fan_mat')
+    parser.add_argument('--wta-th', type=float, default=0.3)
+    parser.add_argument('--sim-len', type=float, default=5.)
+    parser.add_argument('--dt', type=float, default=0.001)
+    parser.add_argument('--tolerance', type=float, default=10.,
+                        help="Largest accepted percentile of the IRT "
+                        "differences in ms")
+    parser.add_argument('--percentile', type=float, default=95.)
+    parser.add_argument('--min-same', type=float, default=0.9,
+                        help="Smallest accepted fraction of seeds with the "
+                        "same responses")
+    args = parser.parse_args()
+
+    settings = [(k, np.float32) for k in args.sample_every]
+    params = dict(d=args.d, amat=args.amat, wta_th=args.wta_th,
+                  sim_len=args.sim_len, dt=args.dt)
+
+    differences = [[] for _ in settings]
+    seconds = np.zeros(len(settings) + 1)
+    for seed in range(args.seed_start, args.seed_start + args.seeds):
+        reference, decoders = simulate(seed, settings, **params)
+        seconds[0] += reference.seconds
+        for i, decoder in enumerate(decoders):
+            differences[i].append(irt_differences(reference, decoder))
+            seconds[i+1] += decoder.seconds
+        print('seed {}: {} responses'.format(seed, len(reference.responses)))
+
+    print('reference (every timestep, float64): {:.3f}s decoding'.format(
+        seconds[0]))
+    ok = True
+    for (k, dtype), diffs, s in zip(settings, differences, seconds[1:]):
+        same = [d for d in diffs if d is not None]
+        ok &= len(same) >= args.min_same*len(diffs)
+        line = 'every {:>2} timesteps, {}: same responses for {}/{} seeds'\
+            .format(k, np.dtype(dtype).name, len(same), len(diffs))
+        if len(same) > 0 and sum(len(d) for d in same) > 0:
+            irt_diffs = np.concatenate(same)
+            q = np.percentile(irt_diffs, args.percentile)
+            ok &= q <= args.tolerance + 1e-6
+            line += (', IRT differences median {:.1f}ms, {:g}th percentile '
+                     '{:.1f}ms, max {:.1f}ms').format(
+                         np.median(irt_diffs), args.percentile, q,
+                         np.max(irt_diffs))
+        print('{}, {:.3f}s decoding'.format(line, s))
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,266 @@
+"""
+Benchmark suite for the semantic fluency pipeline.
+
+Times every stage, from reading the FAN data to the post-processing of the
+responses, and compares the timings with baselines recorded on the same
+machine:
+
+    python run_benchmarks.py --record   # store baselines.json
+    python run_benchmarks.py            # compare, exit code 1 on regressions
+
+A benchmark regresses if it is slower than its baseline by more than the
+threshold (a fraction of the baseline). Benchmarks whose input data has not
+been created yet (see README.md) are skipped.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+data_path = os.path.join(benchmarks_dir, os.pardir, 'association_data')
+animals_path = os.path.join(
+    benchmarks_dir, os.pardir, 'animal_data', 'animal_words.txt')
+
+sys.path.insert(0, os.path.join(
+    benchmarks_dir, os.pardir, 'cogsci17_semflu', 'models'))
+
+benchmarks = []
+
+
+def benchmark(name, repeat=3):
+    """Registers a benchmark.
+
+    The decorated function does the setup and returns the function to time.
+    It raises IOError (or OSError) if its input data is missing.
+    """
+    def register(setup):
+        benchmarks.append((name, setup, repeat))
+        return setup
+    return register
+
+
+def load_fan():
+    from cogsci17_semflu import fan
+    words, assoc_db = fan.load_assoc_db(os.path.join(data_path, 'fan_db.pkl'))
+    animal_words = [
+        w.upper().strip() for w in open(animals_path, 'r').readlines()]
+    animal_words = [w for w in animal_words if w in words] + ['ANIMAL']
+    return words, assoc_db, animal_words
+
+
+@benchmark('fan.load_free_association_data', repeat=1)
+def bench_load_free_association_data():
+    from cogsci17_semflu import fan
+    raw_path = os.path.join(data_path, 'raw_fan')
+    if not os.path.isdir(raw_path):
+        raise IOError("No raw FAN data in {}.".format(raw_path))
+    return lambda: fan.load_free_association_data(raw_path)
+
+
+@benchmark('fan.get_assoc_mat (157 words)')
+def bench_get_assoc_mat_animals():
+    from cogsci17_semflu import fan
+    words, assoc_db, animal_words = load_fan()
+    return lambda: fan.get_assoc_mat(
+        words, assoc_db, usewords=animal_words, normalize=True)
+
+
+@benchmark('fan.get_assoc_mat (5018 words)')
+def bench_get_assoc_mat_full():
+    from cogsci17_semflu import fan
+    words, assoc_db, _ = load_fan()
+    usewords = sorted(words)
+    return lambda: fan.get_assoc_mat(words, assoc_db, usewords=usewords)
+
+
+@benchmark('fan.gen_spa_vocab (157 words, d=256)')
+def bench_gen_spa_vocab():
+    from cogsci17_semflu import fan
+    _, i2w, _ = fan.load_assoc_mat(data_path, 'fan_mat')
+    i2w = [w.upper() for w in i2w]
+    return lambda: fan.gen_spa_vocab(
+        256, i2w, rng=np.random.RandomState(0))
+
+
+@benchmark('fan.gen_spa_vocab (all FAN words, d=512, max_similarity=1)')
+def bench_gen_spa_vocab_full():
+    from cogsci17_semflu import fan
+    words, _, _ = load_fan()
+    words = sorted(w for w in words if w[0].isupper())
+    return lambda: fan.gen_spa_vocab(
+        512, words, rng=np.random.RandomState(0), max_similarity=1.)
+
+
+def make_semflu():
+    from cogsci17_semflu import fan
+    from wta_semflu import SemFlu
+    if not os.path.exists(fan.assoc_mat_file(data_path, 'fan_mat')):
+        raise IOError("No fan_mat in {}.".format(data_path))
+    return SemFlu().make_model(d=256, seed=0, amat='fan_mat')
+
+
+@benchmark('SemFlu model build', repeat=1)
+def bench_semflu_build():
+    import nengo
+    make_semflu()
+
+    def build():
+        with nengo.Simulator(make_semflu(), progress_bar=False):
+            pass
+    return build
+
+
+@benchmark('SemFlu simulation (1 simulated s)', repeat=1)
+def bench_semflu_simulation():
+    import nengo
+    sim = nengo.Simulator(make_semflu(), progress_bar=False)
+    sim.run(0.1)  # warm up
+    return lambda: sim.run(1.)
+
+
+@benchmark('process_output.responses_to_output (141 seeds)')
+def bench_responses_to_output():
+    from bench_process_output import synthetic_simulations
+    from process_output import responses_to_output
+    df = synthetic_simulations(141, rng=np.random.RandomState(0))
+    return lambda: responses_to_output(df, 36)
+
+
+@benchmark('process_output.responses_to_output (10000 seeds)', repeat=1)
+def bench_responses_to_output_large():
+    from bench_process_output import synthetic_simulations
+    from process_output import responses_to_output
+    df = synthetic_simulations(10000, rng=np.random.RandomState(0))
+    return lambda: responses_to_output(df, 36)
+
+
+@benchmark('get_category_switches_heuristic_batch (141 x 36 responses)')
+def bench_category_switches_heuristic():
+    from bench_category_switches import random_sequence
+    from cogsci17_semflu import process_responses as pr
+    rng = np.random.RandomState(0)
+    sequences = [random_sequence(36, rng) for _ in range(141)]
+    times = [list(rng.gamma(2., 500., 36)) for _ in range(141)]
+    return lambda: pr.get_category_switches_heuristic_batch(sequences, times)
+
+
+@benchmark('get_category_switches (141 x 36 responses)')
+def bench_category_switches():
+    from bench_category_switches import random_sequence
+    from cogsci17_semflu import process_responses as pr
+    category_to_animal, animal_to_category = pr.animal_categories()
+    rng = np.random.RandomState(0)
+    sequences = [random_sequence(36, rng) for _ in range(141)]
+    return lambda: [
+        pr.get_category_switches(
+            s, animal_to_category, category_to_animal)
+        for s in sequences]
+
+
+@benchmark('results.read_rows (10000 runs, 3 columns)')
+def bench_read_results():
+    import tempfile
+    from cogsci17_semflu import results
+    rng = np.random.RandomState(0)
+    words = ['W{}'.format(i) for i in range(157)]
+    path = os.path.join(tempfile.mkdtemp(), results.store_name)
+    for start in range(0, 10000, 500):
+        results.append_rows(path, [
+            dict(seed=seed, d=256, wta_th=0.3, amat='fan_mat',
+                 responses=list(rng.choice(words, 36)),
+                 irt=list(rng.gamma(2., 500., 36)))
+            for seed in range(start, start + 500)],
+            kinds=results.semflu_kinds)
+    return lambda: results.read_rows(
+        path, columns=['seed', 'responses', 'irt'])
+
+
+def run(pattern=''):
+    """Runs all benchmarks whose name contains `pattern`.
+
+    Returns
+    -------
+    dict
+        Best wall time in seconds for every benchmark that was run.
+    """
+    results = {}
+    for name, setup, repeat in benchmarks:
+        if pattern not in name:
+            continue
+        try:
+            f = setup()
+        except (IOError, OSError) as e:
+            print('{:<60} skipped ({})'.format(name, e))
+            continue
+        results[name] = min(timeit.repeat(f, number=1, repeat=repeat))
+        print('{:<60} {:9.4f}s'.format(name, results[name]))
+    return results
+
+
+def compare(results, baselines, threshold):
+    """Prints the change of every result relative to its baseline.
+
+    Returns
+    -------
+    list
+        Names of the benchmarks that regressed by more than `threshold`.
+    """
+    regressions = []
+    for name, t in sorted(results.items()):
+        if name not in baselines:
+            continue
+        change = t/baselines[name] - 1.
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print('{:<60} {:+7.1%}{}'.format(
+            name, change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--record', action='store_true',
+        help="Store the timings as new baselines")
+    parser.add_argument(
+        '--baselines', type=str,
+        default=os.path.join(benchmarks_dir, 'baselines.json'),
+        help="File with the baseline timings")
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help="Allowed slowdown as fraction of the baseline (default: 0.2)")
+    parser.add_argument(
+        '--only', type=str, default='',
+        help="Only run benchmarks whose name contains this string")
+    args = parser.parse_args()
+
+    results = run(args.only)
+
+    name = 'SemFlu simulation (1 simulated s)'
+    if name in results:
+        print('Simulator throughput: {:.3f} simulated s per wall s'.format(
+            1./results[name]))
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, 'r') as f:
+            baselines = json.load(f)
+
+    if args.record:
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print('Recorded baselines in', args.baselines)
+    elif len(baselines) > 0:
+        print()
+        print('Change relative to baselines:')
+        if len(compare(results, baselines, args.threshold)) > 0:
+            sys.exit(1)
@@ -0,0 +1,129 @@
+"""
+Disk cache for the vocabulary vectors and the cue to state transform used by
+the SemFlu model.
+
+Entries are content addressed: the key is a hash of the association matrix
+file, the vector dimensionality, the seed used to create the vocabulary and
+the word list. Each entry is a single ``.npz`` file in the cache directory.
+When the total size of the cache exceeds a limit, the least recently used
+entries are removed.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+max_cache_bytes = 2**30
+
+
+def file_hash(path, blocksize=2**20):
+    """Returns the SHA-1 hex digest of the contents of the file at `path`."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def transform_key(amat_hash, d, seed, word_list, rank=0):
+    """Returns the cache key for a vocabulary and transform.
+
+    Parameters
+    ----------
+    amat_hash : str
+        Hash of the association matrix file (see `file_hash`).
+    d : int
+        Dimensionality of the semantic pointers.
+    seed : int
+        Seed used to generate the vocabulary.
+    word_list : sequence of str
+        Words in the vocabulary, in order.
+    rank : int, optional
+        Rank of the approximated association matrix (0: exact).
+    """
+    h = hashlib.sha1()
+    h.update(amat_hash.encode('ascii'))
+    h.update('\0{}\0{}\0'.format(int(d), int(seed)).encode('ascii'))
+    h.update('\0'.join(word_list).encode('utf-8'))
+    if rank > 0:
+        h.update('\0rank={}'.format(int(rank)).encode('ascii'))
+    return h.hexdigest()
+
+
+def load_transform(cache_dir, key):
+    """Loads a cached entry.
+
+    Returns
+    -------
+    tuple or None
+        (keys, vectors, transform) or None if there is no entry for `key`.
+    """
+    filename = os.path.join(cache_dir, key + '.npz')
+    try:
+        with np.load(filename) as f:
+            entry = ([str(k) for k in f['keys']], f['vectors'],
+                     f['transform'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+    # mark as recently used for the eviction
+    try:
+        os.utime(filename, None)
+    except OSError:
+        pass
+    return entry
+
+
+def store_transform(cache_dir, key, keys, vectors, transform,
+                    max_bytes=None):
+    """Stores an entry in the cache and evicts old entries if necessary.
+
+    The file is written to a temporary name first and then renamed, so that
+    concurrent processes never read a partially written entry.
+    """
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, keys=np.array(keys), vectors=vectors,
+                     transform=transform)
+        os.rename(tmp_file, os.path.join(cache_dir, key + '.npz'))
+    except:
+        os.remove(tmp_file)
+        raise
+
+    evict(cache_dir, max_cache_bytes if max_bytes is None else max_bytes)
+
+
+def evict(cache_dir, max_bytes):
+    """Removes least recently used entries until the cache fits `max_bytes`.
+    """
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith('.npz'):
+            continue
+        filename = os.path.join(cache_dir, filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, filename))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, filename in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        total -= size
@@ -6,15 +6,28 @@ strengthsfor three different sources of association data:
     - Beagle dataset
 
 Pickled files are directly used by the model to run the simulation.
+
+The files are built incrementally: every artifact is keyed by a hash of its
+input files, its parameters and the keys of the artifacts it depends on, and
+is only rebuilt if that key changed (or its output is missing). Artifacts that
+do not depend on each other are built concurrently. Keys of the built
+artifacts are stored in build_stamps.json in the association data directory.
 """
 
 from __future__ import print_function
 
-import fan
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+
+import fan
 import pandas as pd
 import numpy as np
 
+from cogsci17_semflu.cache import file_hash
+
 path = os.path.join(
     os.path.dirname(__file__), os.pardir, 'association_data')
 
@@ -31,28 +44,58 @@ animal_words.append('ANIMAL')
 animal_words.remove('DEVIL')
 animal_words.remove('SPONGE')
 
+stamps_file = os.path.join(path, 'build_stamps.json')
+
+
+def raw_fan_files():
+    raw_path = os.path.join(path, 'raw_fan')
+    return [os.path.join(raw_path, f) for f in sorted(os.listdir(raw_path))
+            if f.startswith('Cue_Target_Pairs.')]
+
 
 def create_fan_db():
+    # a worker of the build pool cannot start its own pool
+    processes = 1 if multiprocessing.current_process().daemon else None
     words, assoc_db = fan.load_free_association_data(
-        os.path.join(path, 'raw_fan'))
+        os.path.join(path, 'raw_fan'), processes=processes)
 
     f_name = 'fan_db.pkl'
     fan.save_assoc_db(os.path.join(path, f_name), words, assoc_db)
+
+    print('Created', f_name, 'in', path)
+
+
+def create_fan_mat(normalize=True):
+    words, assoc_db = fan.load_assoc_db(os.path.join(path, 'fan_db.pkl'))
     am, i2w, w2i = fan.get_assoc_mat(
         words, assoc_db, usewords=animal_words,
-        normalize=True)
+        normalize=normalize)
 
     fan.save_assoc_mat(path, 'fan_mat', am, i2w, w2i)
 
-    print('Created', f_name, 'in', path)
+    print('Created fan_mat in', path)
+
+
+def create_fan_full_mat(normalize=True):
+    """
+    Sparse FAN matrix of all words (for models with the full vocabulary).
+    """
+    words, assoc_db = fan.load_assoc_db(os.path.join(path, 'fan_db.pkl'))
+    # semantic pointer names have to start with a capital letter
+    usewords = sorted(w for w in words if w[0].isupper())
+    am, i2w, w2i = fan.get_assoc_mat(
+        words, assoc_db, usewords=usewords, normalize=normalize, sparse=True)
+
+    fan.save_assoc_mat(path, 'fan_full_mat', am, i2w, w2i)
+
+    print('Created fan_full_mat in', path)
 
 
 def create_fanbin_db():
     """
     Binary FAN matrix.
     """
-    words, assoc_db = fan.load_free_association_data(
-        os.path.join(path, 'raw_fan'))
+    words, assoc_db = fan.load_assoc_db(os.path.join(path, 'fan_db.pkl'))
 
     adb = []
     for cue, target, _ in assoc_db:
@@ -109,8 +152,146 @@ def create_corpora_db(beagle=False, normalize=True):
     print('Created', name, 'dataset in:', path)
 
 
+# Build graph. Every artifact has a function that returns its input files,
+# the artifacts it depends on, the parameters passed to the function that
+# builds it, further data that goes into its key (extra) and the files it
+# creates.
+artifacts = {
+    'fan_db': lambda: dict(
+        inputs=raw_fan_files(), deps=[], params={},
+        build=create_fan_db, outputs=['fan_db.pkl']),
+    'fan_mat': lambda: dict(
+        inputs=[], deps=['fan_db'],
+        params=dict(normalize=True), extra=dict(animal_words=animal_words),
+        build=create_fan_mat, outputs=['fan_mat.npz']),
+    'fan_full_mat': lambda: dict(
+        inputs=[], deps=['fan_db'], params=dict(normalize=True),
+        build=create_fan_full_mat, outputs=['fan_full_mat.npz']),
+    'fanbin_mat': lambda: dict(
+        inputs=[], deps=['fan_db'], params={},
+        extra=dict(animal_words=animal_words),
+        build=create_fanbin_db, outputs=['fanbin_db.pkl', 'fanbin_mat.npz']),
+    'ngram_mat': lambda: dict(
+        inputs=[fan.assoc_mat_file(path, 'google_normalized')], deps=[],
+        params=dict(normalize=True), extra=dict(animal_words=animal_words),
+        build=create_corpora_db, outputs=['ngram_mat.npz']),
+    'beagle_mat': lambda: dict(
+        inputs=[os.path.join(path, 'beagle.csv')], deps=[],
+        params=dict(beagle=True, normalize=True),
+        extra=dict(animal_words=animal_words),
+        build=create_corpora_db, outputs=['beagle_mat.npz']),
+}
+
+
+def artifact_keys(names):
+    """Returns the keys of the artifacts `names` and all their
+    dependencies."""
+    keys = {}
+
+    def key(name):
+        if name not in keys:
+            spec = artifacts[name]()
+            h = hashlib.sha1()
+            h.update(name.encode('utf-8'))
+            for filename in spec['inputs']:
+                h.update(os.path.basename(filename).encode('utf-8'))
+                h.update(file_hash(filename).encode('ascii'))
+            for dep in spec['deps']:
+                h.update(key(dep).encode('ascii'))
+            params = dict(spec['params'], **spec.get('extra', {}))
+            h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+            keys[name] = h.hexdigest()
+        return keys[name]
+
+    for name in names:
+        key(name)
+    return keys
+
+
+def load_stamps():
+    if not os.path.exists(stamps_file):
+        return {}
+    with open(stamps_file, 'r') as f:
+        return json.load(f)
+
+
+def save_stamps(stamps):
+    with open(stamps_file, 'w') as f:
+        json.dump(stamps, f, indent=2, sort_keys=True)
+
+
+def is_stale(name, key, stamps):
+    outputs = artifacts[name]()['outputs']
+    return stamps.get(name) != key or not all(
+        os.path.exists(os.path.join(path, f)) for f in outputs)
+
+
+def build_artifact(name):
+    spec = artifacts[name]()
+    spec['build'](**spec['params'])
+    return name
+
+
+def build(names, force=False, processes=None):
+    """Builds the artifacts `names` (and their dependencies) that are stale.
+
+    Parameters
+    ----------
+    names : sequence of str
+        Artifacts to build, keys of `artifacts`.
+    force : bool, optional
+        Rebuild all artifacts regardless of their keys.
+    processes : int, optional
+        Number of artifacts built concurrently, defaults to the number of
+        CPUs.
+    """
+    keys = artifact_keys(names)
+    stamps = load_stamps()
+    todo = set(
+        name for name in keys if force or is_stale(name, keys[name], stamps))
+
+    # anything depending on a rebuilt artifact is rebuilt as well, its key
+    # changed or its input gets overwritten
+    changed = True
+    while changed:
+        changed = False
+        for name in set(keys) - todo:
+            if any(dep in todo for dep in artifacts[name]()['deps']):
+                todo.add(name)
+                changed = True
+
+    for name in sorted(set(keys) - todo):
+        print('Up to date:', name)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        while len(todo) > 0:
+            ready = sorted(
+                name for name in todo
+                if not any(dep in todo for dep in artifacts[name]()['deps']))
+            for name in pool.imap_unordered(build_artifact, ready):
+                todo.remove(name)
+                stamps[name] = keys[name]
+                save_stamps(stamps)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
 if __name__ == "__main__":
-    create_fan_db()
-    create_fanbin_db()  # FAN data without weight information
-    create_corpora_db()
-    create_corpora_db(beagle=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'artifacts', nargs='*', default=sorted(artifacts),
+        help="Artifacts to build (default: all)")
+    parser.add_argument(
+        '--force', action='store_true',
+        help="Rebuild artifacts even if they are up to date")
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help="Number of artifacts built concurrently")
+    args = parser.parse_args()
+
+    build(args.artifacts, force=args.force, processes=args.processes)
@@ -1,17 +1,19 @@
+import multiprocessing
 import os
 import re
+import struct
+import zipfile
 
 import numpy as np
 import pandas as pd
+import scipy.sparse
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
-from nengo import spa
 
-
-def load_free_association_data(path, column='FSG'):
+def load_free_association_data(path, column='FSG', processes=None):
     """Loads the free association data from `path` and saves the list of words
     and the tuple as a single pickle file in the fan_db directory.
 
@@ -22,44 +24,113 @@ def load_free_association_data(path, column='FSG'):
     column : str, optional
         Column in the data files that gives the association strength. Use 'FSG'
         for forward strength and 'BSG' for backward strength.
+    processes : int, optional
+        Number of processes parsing the data files (see
+        load_free_association_arrays).
     Returns
     -------
     A tuple (words, association_database) where words is a set of all occuring
     words (either as cue or target) and association_database is a list of
     associations. Each association is a tuple (cue, target, strength).
     """
-    normed_responses = 0
-    words = set()
-    association_database = []
+    vocab, cue_ids, target_ids, strengths = load_free_association_arrays(
+        path, column, processes)
 
-    for filename in os.listdir(path):
-        if not filename.startswith('Cue_Target_Pairs.'):
-            continue
+    words = set(vocab)
+    association_database = list(zip(
+        vocab[cue_ids].tolist(), vocab[target_ids].tolist(),
+        strengths.tolist()))
 
-        # comment='<' is a hackish way to skip HTML tags
-        df = pd.read_csv(
-            os.path.join(path, filename), skipinitialspace=True,
-            comment='<', encoding='latin1')
-        df[column] = pd.to_numeric(df[column])
+    assert len(words) == 5018, "Number words should be 5018."
+    assert len(association_database) == 63619, \
+        "Number of normed responses should be 63619"
 
-        df_normed = df[df['NORMED?'] == 'YES']
-        normed_responses += len(df_normed)
+    return words, association_database
 
-        # extract norms
-        for i, row in df_normed.iterrows():
-            cue = sanitize(row['CUE']).upper()
-            target = sanitize(row['TARGET']).upper()
-            words.add(cue)
-            words.add(target)
 
-            strength = row[column]
-            association_database.append((cue, target, strength))
+def load_free_association_arrays(path, column='FSG', processes=None):
+    """Loads the free association data from `path` as arrays.
 
-    assert len(words) == 5018, "Number words should be 5018."
-    assert normed_responses == 63619, \
-        "Number of normed responses should be 63619"
+    The data files are parsed in parallel and the result is cached in
+    ``fan_cache_<column>.npz`` in `path`. The cache is used as long as the
+    names, sizes and modification times of the data files do not change.
 
-    return words, association_database
+    Parameters
+    ----------
+    path : str
+        Path to load data from.
+    column : str, optional
+        Column in the data files that gives the association strength.
+    processes : int, optional
+        Number of processes parsing the data files, defaults to the number of
+        CPUs. With 1 the files are parsed in this process.
+
+    Returns
+    -------
+    tuple
+        (vocab, cue_ids, target_ids, strengths) as returned by
+        assoc_db_to_arrays.
+    """
+    filenames = sorted(
+        f for f in os.listdir(path) if f.startswith('Cue_Target_Pairs.'))
+    sources = np.array([
+        '{}:{}:{}'.format(f, st.st_size, st.st_mtime) for f, st in
+        ((f, os.stat(os.path.join(path, f))) for f in filenames)])
+
+    cache_file = os.path.join(path, 'fan_cache_{}.npz'.format(column))
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as f:
+            if np.array_equal(f['sources'], sources):
+                return (f['vocab'].astype(object),
+                        f['cue_ids'].astype(np.intp),
+                        f['target_ids'].astype(np.intp), f['strengths'])
+
+    jobs = [(os.path.join(path, f), column) for f in filenames]
+    if processes == 1:
+        parsed = [parse_free_association_file(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            parsed = pool.map(parse_free_association_file, jobs)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    cues = np.concatenate([cue for cue, _, _ in parsed])
+    targets = np.concatenate([target for _, target, _ in parsed])
+    strengths = np.concatenate([strength for _, _, strength in parsed])
+
+    codes, vocab = pd.factorize(np.concatenate([cues, targets]))
+    vocab = np.asarray(vocab, dtype=object)
+    n = len(cues)
+    cue_ids = codes[:n].astype(np.intp)
+    target_ids = codes[n:].astype(np.intp)
+
+    np.savez(
+        cache_file, sources=sources, vocab=vocab.astype(np.unicode_),
+        cue_ids=cue_ids.astype(np.int32),
+        target_ids=target_ids.astype(np.int32), strengths=strengths)
+
+    return vocab, cue_ids, target_ids, strengths
+
+
+def parse_free_association_file(args):
+    """Returns the cues, targets and strengths of the normed responses in a
+    single free association data file as arrays."""
+    filename, column = args
+
+    # comment='<' is a hackish way to skip HTML tags
+    df = pd.read_csv(
+        filename, skipinitialspace=True, comment='<', encoding='latin1')
+    df = df[df['NORMED?'] == 'YES']
+
+    cues = df['CUE'].map(sanitize).str.upper()
+    targets = df['TARGET'].map(sanitize).str.upper()
+    return (cues.values.astype(object), targets.values.astype(object),
+            pd.to_numeric(df[column]).values.astype(float))
 
 
 def load_assoc_db(path):
@@ -84,24 +155,75 @@ def sanitize(w):
     return re.sub(r'\W', '_', w)
 
 
-def get_assoc_mat(words, association_db, usewords=None, normalize=False):
+def assoc_db_to_arrays(association_db):
+    """
+    Converts a list of (cue, target, strength) tuples into arrays.
+
+    Returns
+    -------
+    tuple
+        (vocab, cue_ids, target_ids, strengths) where vocab is an array of all
+        words occuring in the database and cue_ids and target_ids index into
+        vocab.
+    """
+    if len(association_db) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return np.zeros(0, dtype=object), empty, empty, np.zeros(0)
+
+    cues, targets, strengths = zip(*association_db)
+    codes, vocab = pd.factorize(np.array(cues + targets, dtype=object))
+    n = len(cues)
+    return (np.asarray(vocab, dtype=object), codes[:n].astype(np.intp),
+            codes[n:].astype(np.intp), np.array(strengths, dtype=float))
+
+
+def get_assoc_mat(words, association_db, usewords=None, normalize=False,
+                  sparse=False):
     """
     Returns association matrix and corresponding mappings between words and
     their ids and the other way around.
         usewords: list of words to be extracted from the database, if None use
             all
         normalize: bool, normalize rows of the matrix at the end
+        sparse: bool, return a scipy.sparse CSR matrix instead of a dense array
     """
     if usewords is None:
         usewords = list(words)
 
     w2i = {w: i for i, w in enumerate(usewords)}  # word->id mapping
     i2w = list(usewords)
+    n = len(w2i)
+
+    # map database word ids to matrix indices, -1 for words not in usewords
+    vocab, cue_ids, target_ids, strengths = assoc_db_to_arrays(association_db)
+    vocab_idx = pd.Index(vocab).get_indexer(list(w2i.keys()))
+    found = vocab_idx >= 0
+    lookup = np.full(len(vocab), -1, dtype=np.intp)
+    use_idx = np.array(list(w2i.values()), dtype=np.intp)
+    lookup[vocab_idx[found]] = use_idx[found]
+
+    rows = lookup[cue_ids]
+    cols = lookup[target_ids]
+    valid = (rows >= 0) & (cols >= 0)
+    rows, cols, strengths = rows[valid], cols[valid], strengths[valid]
+
+    # later entries overwrite earlier ones for repeated (cue, target) pairs
+    _, last = np.unique((rows*n + cols)[::-1], return_index=True)
+    last = len(rows) - 1 - last
+    rows, cols, strengths = rows[last], cols[last], strengths[last]
 
-    assoc_mat = np.zeros((len(w2i), len(w2i)))
-    for cue, target, strength in association_db:
-        if usewords is words or cue in usewords and target in usewords:
-            assoc_mat[w2i[cue], w2i[target]] = strength
+    if sparse:
+        assoc_mat = scipy.sparse.csr_matrix(
+            (strengths, (rows, cols)), shape=(n, n))
+        assoc_mat.eliminate_zeros()
+
+        if normalize:
+            assoc_mat = normalize_sparse_rows(assoc_mat)
+
+        return assoc_mat, i2w, w2i
+
+    assoc_mat = np.zeros((n, n))
+    assoc_mat[rows, cols] = strengths
 
     if normalize:
         # assoc_mat /= np.linalg.norm(assoc_mat, axis=1)[:, None]
@@ -112,14 +234,168 @@ def get_assoc_mat(words, association_db, usewords=None, normalize=False):
     return assoc_mat, i2w, w2i
 
 
-def gen_spa_vocab(dimensions, word_list):
+def normalize_sparse_rows(mat):
+    """
+    Divides every row of the sparse matrix `mat` by its sum. Rows summing up to
+    zero stay empty, which matches the dense normalization in get_assoc_mat.
+    """
+    mat = scipy.sparse.csr_matrix(mat, dtype=float, copy=True)
+    row_sums = np.asarray(mat.sum(axis=1)).ravel()
+    mat.data /= np.repeat(row_sums, np.diff(mat.indptr))
+    mat.data = np.nan_to_num(mat.data)
+    mat.eliminate_zeros()
+    return mat
+
+
+def assoc_transform(vectors, assoc_mat):
+    """
+    Returns the transform vectors.T * assoc_mat.T * vectors, which maps the
+    semantic pointer of a word to the sum of the pointers of its associates
+    weighted by the association strengths.
+        assoc_mat: dense array or scipy.sparse matrix, for a sparse matrix the
+            cost is O(nnz*d + n*d^2) instead of O(n^2*d)
+    """
+    if scipy.sparse.issparse(assoc_mat):
+        return np.dot(vectors.T, np.asarray(assoc_mat.T.dot(vectors)))
+    return np.dot(vectors.T, np.dot(assoc_mat.T, vectors))
+
+
+def low_rank_assoc(assoc_mat, rank):
+    """
+    Returns the truncated singular value decomposition (u, s, vt) of an
+    association matrix (dense or scipy.sparse) with the `rank` largest singular
+    values, so that assoc_mat ~ u * diag(s) * vt, and the relative error
+    |assoc_mat - u * diag(s) * vt| / |assoc_mat| (Frobenius norms).
+    """
+    from scipy.sparse.linalg import svds
+
+    if not 0 < rank < min(assoc_mat.shape):
+        raise ValueError(
+            "rank must be between 1 and {}.".format(min(assoc_mat.shape) - 1))
+
+    if scipy.sparse.issparse(assoc_mat):
+        assoc_mat = scipy.sparse.csr_matrix(assoc_mat, dtype=float)
+        norm2 = np.sum(assoc_mat.data**2)
+    else:
+        assoc_mat = np.asarray(assoc_mat, dtype=float)
+        norm2 = np.sum(assoc_mat**2)
+
+    # fixed start vector, so that the result does not change between runs
+    v0 = np.random.RandomState(0).rand(min(assoc_mat.shape))
+    u, s, vt = svds(assoc_mat, k=rank, v0=v0)
+
+    error = 0. if norm2 == 0 else np.sqrt(max(norm2 - np.sum(s**2), 0)/norm2)
+    return u, s, vt, error
+
+
+def low_rank_transform(vectors, u, s, vt):
+    """
+    Returns assoc_transform for the association matrix u * diag(s) * vt (see
+    low_rank_assoc) in O(n*d*rank).
+    """
+    return np.dot(np.dot(vectors.T, vt.T)*s, np.dot(u.T, vectors))
+
+
+def random_pointers(n, dimensions, rng=None, max_similarity=0.1,
+                    attempts=100):
+    """
+    Returns an n x dimensions array of random unit vectors, the same vectors
+    (drawn in the same order from `rng`) that spa.Vocabulary.create_pointer
+    creates for n new words.
+
+    Like nengo, every vector after the first is redrawn until its similarity
+    to all previous vectors is below `max_similarity`, keeping the best of
+    `attempts` candidates. The candidates are drawn and compared in blocks and
+    `rng` is rewound to after the chosen candidate. With `max_similarity` >= 1
+    no vector is redrawn and all are drawn at once.
+    """
+    if rng is None:
+        rng = np.random
+
+    if max_similarity >= 1.:
+        vectors = rng.randn(n, dimensions)
+        for v in vectors:
+            v /= np.linalg.norm(v)
+        return vectors
+
+    vectors = np.zeros((n, dimensions))
+    for i in range(n):
+        if i == 0:
+            v = rng.randn(dimensions)
+            vectors[i] = v/np.linalg.norm(v)
+            continue
+
+        best, best_sim = None, np.inf
+        tried, block = 0, 1
+        while tried < attempts:
+            block = min(block, attempts - tried)
+            state = rng.get_state()
+            candidates = rng.randn(block, dimensions)
+            sims = np.max(np.dot(
+                candidates/np.sqrt(np.sum(candidates**2, axis=1))[:, None],
+                vectors[:i].T), axis=1)
+            below = np.flatnonzero(sims < max_similarity)
+            if len(below) > 0:
+                best = candidates[below[0]]
+                if below[0] + 1 < block:
+                    rng.set_state(state)
+                    rng.randn((below[0] + 1)*dimensions)
+                break
+            j = np.argmin(sims)
+            if sims[j] < best_sim:
+                best, best_sim = candidates[j], sims[j]
+            tried += block
+            block *= 2
+        vectors[i] = best/np.linalg.norm(best)
+
+    return vectors
+
+
+def gen_spa_vocab(dimensions, word_list, rng=None, max_similarity=0.1):
     """
     Given dimensionality of semantic pointer and a word list, returns SPA
     vocabulary with those words as semantic pointers.
+        rng: numpy.random.RandomState used to create the vectors, if None the
+            global numpy random state is used
+        max_similarity: maximum similarity between the vectors, as in
+            spa.Vocabulary
+
+    The vectors are the same as those of spa.Vocabulary.parse on the words
+    joined with '+', but are created in bulk (see random_pointers).
     """
-    vocab = spa.Vocabulary(dimensions)
-    words = '+'.join(word_list)
-    vocab.parse(words)
+    from nengo.exceptions import SpaParseError
+
+    keys = []
+    for word in word_list:
+        if not word[0].isupper():
+            raise SpaParseError(
+                "Semantic pointers must begin with a capital letter.")
+        if word not in keys:
+            keys.append(word)
+    vectors = random_pointers(
+        len(keys), dimensions, rng=rng, max_similarity=max_similarity)
+
+    vocab = vocab_from_vectors(keys, vectors, max_similarity=max_similarity)
+    vocab.rng = rng
+
+    return vocab
+
+
+def vocab_from_vectors(keys, vectors, max_similarity=0.1):
+    """
+    Returns a SPA vocabulary with the given keys and (already generated)
+    vectors, e.g. vectors restored from the transform cache.
+
+    The vocabulary is filled directly instead of with spa.Vocabulary.add,
+    which copies all vectors for every added key.
+    """
+    from nengo import spa
+
+    vocab = spa.Vocabulary(vectors.shape[1], max_similarity=max_similarity)
+    vocab.keys = list(keys)
+    vocab.vectors = np.array(vectors, dtype=float)
+    vocab.pointers = {
+        key: spa.SemanticPointer(v) for key, v in zip(keys, vocab.vectors)}
 
     return vocab
 
@@ -165,35 +441,108 @@ def load_for_model_subset(dimensions, path, num_words=5018,
         return_words=return_words, word_list=word_list)
 
 
-def save_assoc_mat(path, name, strength_mat, id2word, word2id):
+def save_assoc_mat(path, name, strength_mat, id2word, word2id=None):
     """Save an association matrix.
 
+    The matrix and its words are stored together in a single uncompressed
+    ``name.npz`` file, so that load_assoc_mat can memory-map it. Dense matrices
+    are stored as array ``mat``, scipy.sparse matrices in CSR format as arrays
+    ``data``, ``indices``, ``indptr`` and ``shape``. The words are stored in
+    array ``words``. Files of the former format (``name.npy`` and
+    ``name.pkl``) with the same name are removed.
+
     Parameters
     ----------
     path : str
         Output directory.
     name : str
         Filename without extension.
-    strength_mat : ndarray
+    strength_mat : ndarray or scipy.sparse matrix
         Association matrix.
-    id2word: sequence/dict
+    id2word: sequence
         Mapping from index to word.
-    word2id: dict
-        Mapping from word to index.
+    word2id: dict, optional
+        Mapping from word to index. Not stored, it is rebuilt from `id2word`
+        when loading.
     """
     if not os.path.exists(path):
         os.makedirs(path)
 
-    mat_file = os.path.join(path, name + '.npy')
-    map_file = os.path.join(path, name + '.pkl')
+    words = np.array([str(w) for w in id2word])
+    if scipy.sparse.issparse(strength_mat):
+        strength_mat = scipy.sparse.csr_matrix(strength_mat)
+        arrays = dict(
+            data=strength_mat.data, indices=strength_mat.indices,
+            indptr=strength_mat.indptr, shape=np.array(strength_mat.shape))
+    else:
+        arrays = dict(mat=np.asarray(strength_mat))
+    np.savez(os.path.join(path, name + '.npz'), words=words, **arrays)
+
+    for stale_file in [os.path.join(path, name + ext)
+                       for ext in ('.npy', '.pkl')]:
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+
+
+def assoc_mat_file(path, name):
+    """
+    Returns the file the association matrix `name` in `path` is loaded from by
+    load_assoc_mat.
+    """
+    npz_file = os.path.join(path, name + '.npz')
+    if os.path.exists(npz_file):
+        return npz_file
+    return os.path.join(path, name + '.npy')
 
-    np.save(mat_file, strength_mat)
-    with open(map_file, 'wb') as f:
-        pickle.dump(id2word, f, protocol=2)
-        pickle.dump(word2id, f, protocol=2)
 
+def load_npz_memmap(filename, mmap_mode='r'):
+    """Memory-maps the arrays in an uncompressed ``.npz`` file.
 
-def load_assoc_mat(path, name):
+    Returns
+    -------
+    dict
+        Mapping from array names to numpy.memmap instances.
+    """
+    with zipfile.ZipFile(filename) as zf:
+        infos = zf.infolist()
+
+    arrays = {}
+    with open(filename, 'rb') as f:
+        for info in infos:
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(
+                    "Cannot memory-map compressed array {} in {}.".format(
+                        info.filename, filename))
+
+            # skip the local file header, its size is not in the ZipInfo
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = \
+                    np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = \
+                    np.lib.format.read_array_header_2_0(f)
+
+            key = info.filename[:-len('.npy')]
+            if dtype.hasobject:
+                raise ValueError(
+                    "Cannot memory-map object array {} in {}.".format(
+                        key, filename))
+            if np.prod(shape) == 0:
+                arrays[key] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[key] = np.memmap(
+                    filename, dtype=dtype, mode=mmap_mode, offset=f.tell(),
+                    shape=shape, order='F' if fortran_order else 'C')
+    return arrays
+
+
+def load_assoc_mat(path, name, mmap_mode=None):
     """Load an association matrix.
 
     Parameters
@@ -202,20 +551,44 @@ def load_assoc_mat(path, name):
         Input directory
     name : str
         Filename without extension.
+    mmap_mode : str, optional
+        If given, the matrix is memory-mapped with this mode (see numpy.load),
+        so that processes loading the same matrix share its pages. Only
+        supported for matrices saved as ``name.npz``.
 
     Returns:
     --------
     tuple
         (strength_mat, id2word, word2id) with the matrix of association
         strengths strength_mat, mapping from matrix indices to words id2word,
-        and mapping from words to matrix indices.
+        and mapping from words to matrix indices. strength_mat is a
+        scipy.sparse CSR matrix if it was saved as such.
     """
-    mat_file = os.path.join(path, name + '.npy')
-    map_file = os.path.join(path, name + '.pkl')
+    mat_file = assoc_mat_file(path, name)
+
+    if mat_file.endswith('.npz'):
+        if mmap_mode is None:
+            with np.load(mat_file) as f:
+                arrays = {k: f[k] for k in f.files}
+        else:
+            arrays = load_npz_memmap(mat_file, mmap_mode)
+
+        if 'mat' in arrays:
+            strength_mat = arrays['mat']
+        else:
+            strength_mat = scipy.sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=tuple(arrays['shape']))
+    else:
+        strength_mat = np.load(mat_file, mmap_mode=mmap_mode)
+        arrays = {}
 
-    strength_mat = np.load(mat_file)
-    with open(map_file, 'rb') as f:
-        id2word = pickle.load(f)
-        word2id = pickle.load(f)
+    if 'words' in arrays:
+        id2word = [str(w) for w in arrays['words']]
+        word2id = {w: i for i, w in enumerate(id2word)}
+    else:
+        with open(os.path.join(path, name + '.pkl'), 'rb') as f:
+            id2word = pickle.load(f)
+            word2id = pickle.load(f)
 
     return strength_mat, id2word, word2id
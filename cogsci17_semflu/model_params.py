@@ -0,0 +1,22 @@
+"""
+Model parameters of SemFlu shared by the trials that simulate it.
+
+SemFlu (models/wta_semflu.py) and its rate-based surrogate RateSemFlu
+(models/surrogate.py) declare these parameters with model_params, so both
+have the same parameters with the same defaults.
+"""
+
+
+def model_params(trial):
+    """Declares the model parameters of SemFlu on the pytry `trial`."""
+    trial.param('word vector dimensions', d=64)
+    trial.param('cue connection feedback strength', c_fs=.2)
+    trial.param('state connection feedback strength', s_fs=1.)
+    trial.param('cue to state connection strength', cs_s=3)
+    trial.param('simulation length', sim_len=5)
+    trial.param('association matrix', amat='ngram_mat')
+    trial.param('cue state synapse', cs_syn=0.005)
+    trial.param('response to response magnitude synapse', rspm_syn=0.005)
+    trial.param('wta to response synapse', wtar_syn=0.1)
+    trial.param('inhibitory connection', inh_st=-5)
+    trial.param('wta threshold', wta_th=0.3)
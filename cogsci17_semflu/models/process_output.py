@@ -1,20 +1,40 @@
+from __future__ import print_function
+
+import multiprocessing
+import os
+
 import pandas as pd
 import numpy as np
-import os
-import pytry
 
-from cogsci17_semflu.process_responses import get_category_switches_heuristic
-from cogsci17_semflu.fan import load_animal_categories
+from cogsci17_semflu.process_responses import (
+    categorization_tensor, category_table, patch_rows, response_ids,
+    segment_heuristic)
+from cogsci17_semflu.results import read_rows, split_batches, store_name
 
+columns = [u'sid', u'entry', u'irt', u'fpatchnum',
+           u'fpatchitem', u'fitemsfromend',
+           u'flastitem', u'meanirt', u'catitem']
 
-def process_output(data_path, nr_samp=30):
-    animal_cat_path = os.path.join(
-        os.path.dirname(__file__), os.pardir, os.pardir, 'animal_data',
-        'animal_cat_dicts.pkl')
-    ctoa, atoc = load_animal_categories(animal_cat_path)
 
-    # load simulation data
-    df = pd.DataFrame(pytry.read(data_path))
+def load_simulations(data_path, **params):
+    """Loads the simulation results in `data_path`.
+
+    The results are read from the results store in `data_path` if there is
+    one, otherwise from the files written by pytry. Only simulations with the
+    given `params` are loaded (e.g. a single point of a sweep). Simulations
+    without responses are dropped and responses are converted to lower-case.
+    """
+    store = os.path.join(data_path, store_name)
+    if os.path.isdir(store):
+        df = read_rows(
+            store, columns=['seed', 'responses', 'irt'], **params)
+    else:
+        import pytry
+
+        df = pd.DataFrame([
+            result for result in split_batches(pytry.read(data_path))
+            if all(result.get(k) == v for k, v in params.items())])
+    df = df.sort_values('seed').reset_index(drop=True)
 
     # simulations without any responses
     no_resp = np.where(df.responses.apply(lambda x: len(x)).values < 1)[0]
@@ -26,66 +46,117 @@ def process_output(data_path, nr_samp=30):
     df['responses'] = df['responses'].apply(
         func=lambda x: [y.lower() for y in x])
 
-    del df['backend']
-    del df['d']
-    del df['dt']
-    del df['sim_len']
-    del df['amat']
-    del df['c_fs']
-    columns = [u'sid', u'entry', u'irt', u'fpatchnum',
-               u'fpatchitem', u'fitemsfromend',
-               u'flastitem', u'meanirt', u'catitem']
-    output = pd.DataFrame(columns=columns)
-
-    for row_idx, row in df.iterrows():
-        patch_num = 1
-        responses = row.responses[:nr_samp]
-        irts_row = row.irt[:nr_samp]
-        t_cl, animals = get_category_switches_heuristic(responses, irts_row)
-
-        counter = 0
-        for ai, (a_c, t_c) in enumerate(zip(animals, t_cl)):
-            for cai, animal in enumerate(a_c):
-                counter += 1
-
-                # make note if animal last in the cluster
-                last = 0
-                if animal == a_c[-1]:
-                    last = 1
-
-                # position in the cluster from the end
-                fromend = len(a_c)-cai
-
-                #  extract irt (computed automatically in the simulation)
-                irt = t_c[cai]
-
-                output = output.append([{'entry': animal, 'sid': int(row.seed),
-                                         'fpatchnum': patch_num,
-                                         'fpatchitem': cai+1,
-                                         'fitemsfromend': fromend,
-                                         'flastitem': last,
-                                         'catitem': counter,
-                                         'irt': irt, 'meanirt': 1}],
-                                       ignore_index=True)
-            patch_num += 1
-
-    # Convert some bits to integers
-    output['flastitem'] = output['flastitem'].apply(int)
-    output['irt'] = output['irt'].apply(int)
-    output['sid'] = output['sid'].apply(int)
+    return df
+
+
+def init_worker():
+    # the category data is loaded once per worker, not sent with every chunk
+    category_table()
+
+
+def segment_chunk(args):
+    ids, lengths = args
+    return segment_heuristic(categorization_tensor(ids), lengths)
+
+
+def segment_responses(responses, processes=1, chunk_size=1000):
+    """Segments the response sequences `responses` with segment_heuristic.
+
+    Unless `processes` is 1, the sequences are split into chunks of
+    `chunk_size` that are segmented on a pool of `processes` workers (None:
+    one per CPU). Only the category rows of the responses are sent to the
+    workers and the chunks are merged in their original order, so the result
+    does not depend on the number of processes.
+
+    Returns
+    -------
+    tuple
+        (ids, lengths, lower, upper), see response_ids and segment_heuristic.
+    """
+    ids, lengths = response_ids(responses)
+    jobs = [(ids[i:i+chunk_size], lengths[i:i+chunk_size])
+            for i in range(0, max(len(lengths), 1), chunk_size)]
+    if processes == 1 or len(jobs) == 1:
+        parts = [segment_chunk(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=init_worker)
+        try:
+            parts = pool.map(segment_chunk, jobs, chunksize=1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    # chunks have different numbers of patches
+    n_patches = max(lower.shape[1] for lower, _ in parts)
+    lower = np.full((len(lengths), n_patches), -1, dtype=int)
+    upper = np.full((len(lengths), n_patches), -1, dtype=int)
+    start = 0
+    for part_lower, part_upper in parts:
+        end = start + len(part_lower)
+        lower[start:end, :part_lower.shape[1]] = part_lower
+        upper[start:end, :part_upper.shape[1]] = part_upper
+        start = end
+    return ids, lengths, lower, upper
+
+
+def responses_to_output(df, nr_samp=30, processes=1, chunk_size=1000):
+    """Segments the responses of every simulation in `df` into clusters and
+    returns one row per recalled animal (an animal in two clusters has a row
+    for each).
+
+    The simulations are segmented in bulk (see segment_responses, which
+    uses `processes` workers for chunks of `chunk_size` simulations) and the
+    columns are gathered from the resulting arrays.
+    """
+    responses = [r[:nr_samp] for r in df.responses.values]
+    irts = [irt[:nr_samp] for irt in df.irt.values]
+    ids, lengths, lower, upper = segment_responses(
+        responses, processes=processes, chunk_size=chunk_size)
+    rows = patch_rows(lower, upper)
+
+    seq, pos = rows['sequence'], rows['position']
+    flat = (np.cumsum(lengths) - lengths)[seq] + pos
+    n_rows = np.bincount(seq, minlength=len(lengths))
+    last_pos = pos + rows['items_from_end'] - 1
+
+    output = pd.DataFrame({
+        'sid': df.seed.values.astype(int)[seq],
+        'entry': np.array(
+            [r for resp in responses for r in resp] + [None],
+            dtype=object)[flat],
+        'irt': np.array([t for irt in irts for t in irt], dtype=float)[flat],
+        'fpatchnum': rows['patch'],
+        'fpatchitem': rows['item'],
+        # position in the cluster from the end
+        'fitemsfromend': rows['items_from_end'],
+        # make note if animal last in the cluster
+        'flastitem': (ids[seq, pos] == ids[seq, last_pos]).astype(int),
+        'catitem': np.arange(len(seq)) - np.repeat(
+            np.cumsum(n_rows) - n_rows, n_rows) + 1,
+    })
+
+    # irt is extracted (computed automatically in the simulation) in ms
+    output['irt'] = output['irt'].astype(int)
 
     # Compute mean IRTs
-    mean_irt = output.groupby('sid').mean().irt
-    for sid, mirt in mean_irt.iteritems():
-        output.set_value(output.sid == sid, 'meanirt', mirt)
+    output['meanirt'] = output.groupby('sid').irt.transform('mean')
+
+    return output[columns]
+
+
+def process_output(data_path, nr_samp=30, processes=None, **params):
+    """Loads the simulations in `data_path` with the given `params` and
+    returns their output rows (see responses_to_output, which runs on
+    `processes` workers)."""
+    # load simulation data
+    df = load_simulations(data_path, **params)
+    output = responses_to_output(df, nr_samp, processes=processes)
 
     # Compute data on means and std. deviations
-    sids = np.unique(output.sid)
-    avgs = []
-    for sid in sids:
-        nritems = len(output[output.sid == sid])
-        avgs.append(nritems)
-    avgs = np.array(avgs)
+    avgs = output.groupby('sid').size().values
     print('Mean={:.2f}, std={:.2f}, min={:.2f}, max={:.2f}'.format(
         np.mean(avgs), np.std(avgs), np.min(avgs), np.max(avgs)))
 
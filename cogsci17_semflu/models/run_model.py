@@ -1,10 +1,12 @@
-from wta_semflu import SemFlu
+from __future__ import print_function
+
 import numpy as np
 import os
 import argparse
 import pandas.rpy.common as com
 
 from process_output import process_output
+from sweep import run_sweep
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -14,6 +16,16 @@ if __name__ == '__main__':
     parser.add_argument(
         'th', nargs=1, type=float, help="WTA threshold (0.25 for fan_mat)",
         default=0.3)
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help="Number of parallel simulations and post-processing workers "
+        "(default: number of CPUs)")
+    parser.add_argument(
+        '--batch', type=int, default=1,
+        help="Number of seeds simulated together in one simulator")
+    parser.add_argument(
+        '--profile', action='store_true',
+        help="Write phase timings next to the results (see profiling.py)")
     args = parser.parse_args()
 
     amat = args.database[0]
@@ -29,25 +41,29 @@ if __name__ == '__main__':
     # dir-name to store simulations
     fname = '{}_{}r_{}d_{}th_{}n_157w'.format(
             amat, nr_seeds, d, wta_th, nr_resp)
-    print amat, wta_th, fname
+    print(amat, wta_th, fname)
 
     seeds = np.arange(seed_start, nr_seeds)
 
     base_dir = os.path.dirname(__file__)
     results_dir = os.path.join(base_dir, 'data', fname)
 
-    for seed in seeds:
-        SemFlu().run(
-            d=d,
-            seed=seed,
-            sim_len=sim_len,
-            wta_th=wta_th,
-            amat=amat,
-            data_dir=results_dir,
-            backend='nengo_ocl')
+    run_sweep(
+        seeds,
+        data_dir=results_dir,
+        processes=args.processes,
+        batch=args.batch,
+        d=d,
+        sim_len=sim_len,
+        wta_th=wta_th,
+        amat=amat,
+        max_responses=nr_resp,
+        transform_cache=os.path.join(base_dir, 'cache'),
+        profile=args.profile,
+        backend='nengo_ocl')
 
-    print 'Post-processing responses for R-analysis...'
-    output = process_output(results_dir, nr_resp)
+    print('Post-processing responses for R-analysis...')
+    output = process_output(results_dir, nr_resp, processes=args.processes)
 
     csv_path = os.path.join(
         os.path.dirname(__file__), os.pardir, os.pardir, 'model_outputs',
@@ -56,4 +72,4 @@ if __name__ == '__main__':
     r_df = com.convert_to_r_dataframe(output)
     r_df.to_csvfile(csv_path)
 
-    print 'Done with:', fname
+    print('Done with:', fname)
@@ -0,0 +1,401 @@
+"""
+Rate-based surrogate of the SemFlu model for screening parameters.
+
+RateSemFlu runs the cue -> state -> wta -> response -> used_words loop of
+SemFlu with rate equations instead of spiking neurons, for many seeds at once
+in vectorized NumPy, and returns the responses and IRTs in the same format as
+SemFlu.evaluate. Every seed uses the same word vectors as the spiking model
+(see fan.random_pointers) and the same association matrix. nengo is not
+needed.
+
+All vectors in the loop are sums of word vectors (the transform maps a word
+to the sum of its associates), so they are represented by their coefficients
+over the words and similarities are computed with the Gram matrix of the word
+vectors. The components are approximated as follows:
+
+- States represent their (filtered) input plus their feedback through a
+  0.1 s synapse. They saturate word by word (limiting the norm instead would
+  let the strongly inhibited used words suppress all other words).
+- The elements of the associative memories compute the thresholded step
+  function of nengo (1 - exp(-15 x)) of their input similarity minus the
+  threshold and the winner-take-all inhibition from the other elements.
+- The basal ganglia and thalamus select the action with the largest utility.
+- The synapses of all connections are the same as in SemFlu and nengo.spa.
+
+The surrogate is an approximation; how close it is to the spiking model for a
+parameter set is checked with the validation report, e.g.
+
+    python surrogate.py <data_dir of spiking runs>
+
+which simulates the seeds of the spiking runs with the same parameters and
+compares the distributions of the response lengths and IRTs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pytry
+import scipy.sparse
+import scipy.stats
+
+from cogsci17_semflu import fan, results
+from cogsci17_semflu.model_params import model_params
+
+
+def decay(tau, dt):
+    """Returns the weight of the input in a timestep of the lowpass filter
+    with time constant `tau` (exact for constant input, no filter if 0)."""
+    if tau <= 0:
+        return 1.
+    return 1. - np.exp(-dt/tau)
+
+
+def filtered_step(x):
+    """Output function of the associative memory elements for the input
+    similarities minus threshold `x` (represented in [0, 1])."""
+    return 1. - np.exp(-15.*np.clip(x, 0., 1.))
+
+
+def saturate(x, radius=1.):
+    """Limits the word coefficients `x` of a state to [-radius, radius]."""
+    return np.clip(x, -radius, radius)
+
+
+def wta_input(sims, threshold, inhibition, scale=3.):
+    """Input of the associative memory elements with winner-take-all output,
+    given the (filtered) outputs of all elements in `inhibition`."""
+    others = np.sum(inhibition, axis=1, keepdims=True) - inhibition
+    return sims - threshold - scale*others
+
+
+class RateDecoder(object):
+    """Extracts the responses of many seeds from the response similarities.
+
+    Follows the rules of wta_semflu.ResponseDecoder: a word is recorded when
+    it becomes the best match with a similarity above `min_sim`, together
+    with the time since the previous response in ms (the time itself for the
+    first response); words in `skip` are not recorded except as the first.
+    """
+
+    def __init__(self, keys, n_seeds, min_sim=0.8, skip=('ANIMAL',)):
+        self.keys = keys
+        self.min_sim = min_sim
+        self.skipped = np.array([k in skip for k in keys], dtype=bool)
+
+        self.current = np.full(n_seeds, -1, dtype=int)
+        self.last_time = np.full(n_seeds, np.nan)
+        self.responses = [[] for _ in range(n_seeds)]
+        self.irt = [[] for _ in range(n_seeds)]
+
+    def decode(self, t, sims):
+        idx = np.argmax(sims, axis=1)
+        best = sims[np.arange(len(idx)), idx]
+        changed = np.flatnonzero((best > self.min_sim) & (idx != self.current))
+
+        time = 1000*t
+        for s in changed:
+            i = idx[s]
+            if self.current[s] < 0:
+                self.responses[s].append(self.keys[i].lower())
+                self.irt[s].append(time)
+                self.last_time[s] = time
+            elif not self.skipped[i]:
+                self.responses[s].append(self.keys[i].lower())
+                self.irt[s].append(time - self.last_time[s])
+                self.last_time[s] = time
+            self.current[s] = i
+
+    def done(self, t, max_responses=0, idle_stop=0.):
+        """Whether every seed reached `max_responses` distinct responses or
+        had no response for `idle_stop` seconds at time `t` (as SemFlu.done).
+        """
+        n_distinct = np.array([len(set(r)) for r in self.responses])
+        last_time = np.where(np.isnan(self.last_time), 0., self.last_time)
+        done = np.zeros(len(n_distinct), dtype=bool)
+        if max_responses > 0:
+            done |= n_distinct >= max_responses
+        if idle_stop > 0:
+            done |= 1000*t - last_time >= 1000*idle_stop
+        return np.all(done)
+
+
+class RateSemFlu(pytry.Trial):
+    """Rate-based surrogate of SemFlu.
+
+    Has the model parameters of SemFlu (with the same defaults) and simulates
+    the seeds p.seed, ..., p.seed + p.batch - 1 together.
+    """
+
+    def params(self):
+        model_params(self)
+
+        self.param('number of seeds simulated together', batch=1)
+        self.param(
+            'stop after this many distinct responses (0: never)',
+            max_responses=0)
+        self.param(
+            'stop if there was no response for this long (0: never)',
+            idle_stop=0.)
+        self.param('length of simulation chunks when stopping early',
+                   stop_chunk=0.5)
+        self.param('results store to append the results to',
+                   results_store='')
+        self.param('timestep', dt=0.001)
+        self.param('standard deviation of the noise added to the state '
+                   'every timestep', noise=0.)
+
+    def run(self, **kwargs):
+        result = super(RateSemFlu, self).run(**kwargs)
+        p = self.p
+        if p.results_store != '' and result is not None:
+            results.append_trial(p.results_store, self, p, result)
+        return result
+
+    def evaluate(self, p):
+        self.p = p
+        data_dir = os.path.join(
+            os.path.dirname(__file__),
+            os.pardir, os.pardir, 'association_data')
+        assoc_mat, i2w, _ = fan.load_assoc_mat(
+            data_dir, p.amat, mmap_mode='r')
+        i2w = [i.upper() for i in i2w]
+
+        seeds = list(range(p.seed, p.seed + p.batch))
+        decoder = self.simulate(p, seeds, assoc_mat, i2w)
+
+        if p.batch > 1:
+            return {
+                'seeds': seeds,
+                'responses': decoder.responses,
+                'irt': decoder.irt
+                }
+
+        return {
+            'responses': decoder.responses[0],
+            'irt': decoder.irt[0]
+            }
+
+    def simulate(self, p, seeds, assoc_mat, i2w):
+        """Simulates the model for all `seeds` and returns the RateDecoder
+        with their responses (stopping early like SemFlu.simulate)."""
+        n = len(i2w)
+        dt = p.dt
+        n_seeds = len(seeds)
+
+        # similarities of the word vectors of every seed; the noise of a
+        # seed continues its random stream, so it does not depend on the
+        # other seeds of the batch
+        gram = np.empty((n_seeds, n, n))
+        rngs = [np.random.RandomState(seed) for seed in seeds]
+        for k, rng in enumerate(rngs):
+            vectors = fan.random_pointers(n, p.d, rng=rng)
+            gram[k] = np.dot(vectors, vectors.T)
+
+        def similarities(x):
+            return np.matmul(x[:, None, :], gram)[:, 0]
+
+        # the transform maps the coefficients x to x G A
+        if scipy.sparse.issparse(assoc_mat):
+            assoc_t = scipy.sparse.csr_matrix(assoc_mat.T)
+        else:
+            assoc_t = np.asarray(assoc_mat).T
+
+        def transform(y):
+            return np.asarray(assoc_t.dot(y.T)).T
+
+        animal = np.zeros(n)
+        animal[i2w.index('ANIMAL')] = 1.
+
+        decoder = RateDecoder(i2w, n_seeds)
+
+        # filter weights of the synapses
+        a_fb = decay(0.1, dt)        # state feedback
+        a_thal = decay(0.01, dt)     # thalamus channels and direct effects
+        a_bg = decay(0.002, dt)      # basal ganglia input
+        a_act = decay(0.008, dt)     # basal ganglia to thalamus
+        a_default = decay(0.005, dt)
+        a_cs = decay(p.cs_syn, dt)
+        a_wtar = decay(p.wtar_syn, dt)
+        a_rspm = decay(p.rspm_syn, dt)
+        a_wta_inh = decay(0.01, dt)
+        a_dec = decay(0.03, dt)
+
+        shape = (n_seeds, n)
+        cue_in, cue_fb = np.zeros(shape), np.zeros(shape)
+        state_in, inh_in, state_fb = (
+            np.zeros(shape), np.zeros(shape), np.zeros(shape))
+        wta_in, wta_inh = np.zeros(shape), np.zeros(shape)
+        resp_in, resp_inh = np.zeros(shape), np.zeros(shape)
+        route, used_in, used_fb = (
+            np.zeros(shape), np.zeros(shape), np.zeros(shape))
+        dec_in = np.zeros(shape)
+        magnitude = np.zeros((n_seeds, 1))
+        goal_think = np.zeros((n_seeds, 1))
+        utilities = np.zeros((n_seeds, 3))
+        actions = np.zeros((n_seeds, 3))
+
+        steps = int(np.round(p.sim_len/dt))
+        chunk = max(int(np.round(p.stop_chunk/dt)), 1)
+        stop_early = p.max_responses > 0 or p.idle_stop > 0
+        t = 0.
+        for step in range(1, steps + 1):
+            t = step*dt
+
+            # states
+            cue = saturate(cue_in + p.c_fs*cue_fb)
+            state = state_in + inh_in + p.s_fs*state_fb
+            if p.noise > 0:
+                state += p.noise*np.array([rng.randn(n) for rng in rngs])
+            state = saturate(state)
+            used = saturate(used_in + used_fb)
+
+            # associative memories
+            wta_out = filtered_step(
+                wta_input(similarities(wta_in), p.wta_th, wta_inh))
+            resp_out = filtered_step(
+                wta_input(similarities(resp_in), 0.3, resp_inh))
+
+            # action selection, the goal is INIT only at the start
+            goal_init = 1. if t < 0.05 else 0.
+            utilities += a_bg*(np.hstack([
+                np.full((n_seeds, 1), goal_init),
+                goal_think + np.minimum(magnitude, 1.) - 1.,
+                np.full((n_seeds, 1), 0.4)]) - utilities)
+            selected = np.zeros((n_seeds, 3))
+            selected[np.arange(n_seeds), np.argmax(utilities, axis=1)] = 1.
+            actions += a_act*(selected - actions)
+
+            # synapses
+            cue_fb += a_fb*(cue - cue_fb)
+            cue_in += a_thal*(
+                (actions[:, [0]] + actions[:, [2]])*animal +
+                actions[:, [1]]*route - cue_in)
+            used_in += a_thal*(actions[:, [1]]*route - used_in)
+            used_fb += a_fb*(used - used_fb)
+            route += a_thal*(resp_out - route)
+            goal_think += a_thal*(
+                np.sum(actions, axis=1, keepdims=True) - goal_think)
+
+            state_in += a_cs*(p.cs_s*transform(similarities(cue)) - state_in)
+            inh_in += a_default*(p.inh_st*used - inh_in)
+            state_fb += a_fb*(state - state_fb)
+
+            wta_in += a_default*(state - wta_in)
+            wta_inh += a_wta_inh*(wta_out - wta_inh)
+            resp_in += a_wtar*(3*wta_out - resp_in)
+            resp_inh += a_default*(resp_out - resp_inh)
+            magnitude += a_rspm*(
+                np.sum(resp_out, axis=1, keepdims=True) - magnitude)
+
+            dec_in += a_dec*(resp_out - dec_in)
+            decoder.decode(t, similarities(dec_in))
+
+            if (stop_early and step % chunk == 0 and
+                    decoder.done(t, p.max_responses, p.idle_stop)):
+                break
+
+        self.stop_time = t
+        return decoder
+
+
+def load_runs(data_path):
+    """Loads all runs (parameters and results) in `data_path` from its
+    results store or pytry files, one row per seed."""
+    store = os.path.join(data_path, results.store_name)
+    if os.path.isdir(store):
+        return results.read_rows(store)
+    return pd.DataFrame(results.split_batches(pytry.read(data_path)))
+
+
+def run_params(runs):
+    """Returns the values of the RateSemFlu parameters of `runs`, which must
+    be the same for all runs."""
+    params = {}
+    for k in RateSemFlu().param_defaults:
+        if k not in runs.columns or k in ('seed', 'batch', 'results_store'):
+            continue
+        values = runs[k].unique()
+        if len(values) > 1:
+            raise ValueError(
+                "The runs have different values of '{}', validate the runs "
+                "of a single parameter set.".format(k))
+        params[k] = values[0].item() if hasattr(values[0], 'item') \
+            else values[0]
+    return params
+
+
+def describe(values):
+    values = np.asarray(values, dtype=float)
+    return [np.mean(values), np.std(values), np.median(values),
+            np.percentile(values, 10), np.percentile(values, 90)]
+
+
+def validation_report(spiking, surrogate):
+    """Compares the distributions of the results of spiking and surrogate
+    runs (DataFrames with the columns responses and irt).
+
+    Returns
+    -------
+    pandas.DataFrame
+        For the number of responses per run, the time of the first response
+        and the later IRTs (all in ms): mean, standard deviation, median and
+        10th and 90th percentiles of both models and the two-sample
+        Kolmogorov-Smirnov statistic and p-value.
+    """
+    def measures(df):
+        return {
+            'responses': [len(r) for r in df.responses],
+            'first_response': [irt[0] for irt in df.irt if len(irt) > 0],
+            'irt': [t for irt in df.irt for t in irt[1:]],
+        }
+
+    stats = ['mean', 'std', 'median', 'p10', 'p90']
+    columns = (['spiking_' + s for s in stats] +
+               ['surrogate_' + s for s in stats] + ['ks', 'p', 'n_spiking',
+                                                    'n_surrogate'])
+    spiking, surrogate = measures(spiking), measures(surrogate)
+    rows = []
+    index = ['responses', 'first_response', 'irt']
+    for name in index:
+        a, b = spiking[name], surrogate[name]
+        if len(a) == 0 or len(b) == 0:
+            rows.append([np.nan]*(len(columns) - 2) + [len(a), len(b)])
+            continue
+        ks, pvalue = scipy.stats.ks_2samp(a, b)
+        rows.append(describe(a) + describe(b) + [ks, pvalue, len(a), len(b)])
+    return pd.DataFrame(rows, index=index, columns=columns)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compares the surrogate with spiking SemFlu runs")
+    parser.add_argument(
+        'data_dir', type=str, help="Directory with the spiking runs")
+    parser.add_argument(
+        '--out', type=str, default=None,
+        help="Directory for the surrogate runs (default: surrogate in "
+        "data_dir)")
+    parser.add_argument(
+        '--noise', type=float, default=0., help="Noise of the surrogate")
+    args = parser.parse_args()
+
+    spiking = load_runs(args.data_dir)
+    seeds = np.sort(spiking.seed.values.astype(int))
+    params = run_params(spiking)
+    params['noise'] = args.noise
+
+    # the surrogate simulates contiguous seeds together
+    surrogate = []
+    for batch in np.split(seeds, np.flatnonzero(np.diff(seeds) != 1) + 1):
+        result = RateSemFlu().run(
+            seed=int(batch[0]), batch=len(batch), verbose=False,
+            data_dir=args.out or os.path.join(args.data_dir, 'surrogate'),
+            **params)
+        surrogate.extend(results.split_batches([dict(result, seed=batch[0])]))
+
+    report = validation_report(spiking, pd.DataFrame(surrogate))
+    print(report.T.to_string(float_format='%.3f'))
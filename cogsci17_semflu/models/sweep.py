@@ -0,0 +1,395 @@
+"""
+Runs a sweep of SemFlu simulations over many seeds on a process pool.
+
+Every finished simulation is written by pytry as a separate file in the data
+directory, so a sweep that gets interrupted can simply be started again: seeds
+that already have results in the data directory are skipped.
+
+Sweeps over a grid (or a random sample) of model parameters are described by
+a spec (see `spec_points`) and run with `run_grid`, or from the command line:
+
+    python sweep.py spec.json data/my_sweep --processes 8
+    python sweep.py --resume data/my_sweep
+
+The jobs are stored in a queue file in the data directory, which is updated
+whenever a job finished, so that an interrupted sweep can be resumed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+import pytry
+
+from cogsci17_semflu.results import import_pytry, read_rows, store_name
+
+
+# parameters that do not influence the simulation results
+neutral_params = (
+    'transform_cache', 'batch', 'stop_chunk', 'profile', 'results_store')
+
+
+def finished_seeds(data_dir, store=None, **params):
+    """Returns the set of seeds that already have results in `data_dir`.
+
+    Only results whose parameters match the given `params` are taken into
+    account, parameters in `neutral_params` and the pytry system parameters
+    of SemFlu (which are not stored with the results) are ignored. If the
+    results store `store` exists, the seeds are read from it instead of the
+    pytry files.
+    """
+    from wta_semflu import SemFlu
+
+    ignored = set(neutral_params).union(SemFlu().system_params)
+    params = {k: v for k, v in params.items() if k not in ignored}
+    if store is not None and os.path.isdir(store):
+        return set(int(s) for s in read_rows(
+            store, columns=['seed'], **params)['seed'])
+
+    if not os.path.isdir(data_dir):
+        return set()
+
+    seeds = set()
+    for result in pytry.read(data_dir):
+        if all(result.get(k) == v for k, v in params.items()):
+            # batched runs store the results of several seeds
+            seeds.update(int(s) for s in result.get('seeds', [result['seed']]))
+    return seeds
+
+
+def create_store(store, data_dirs):
+    """Creates the results store `store` if it does not exist yet, with the
+    results that pytry already wrote to `data_dirs` (so that they are not
+    simulated again)."""
+    if os.path.isdir(store):
+        return
+    n = sum(import_pytry(d, store) for d in data_dirs if os.path.isdir(d))
+    if n > 0:
+        print('Imported {} earlier results into {}'.format(n, store))
+
+
+def contiguous_batches(seeds, batch):
+    """Splits `seeds` into lists of at most `batch` consecutive seeds."""
+    batches = []
+    for seed in sorted(seeds):
+        if (len(batches) > 0 and seed == batches[-1][-1] + 1 and
+                len(batches[-1]) < batch):
+            batches[-1].append(seed)
+        else:
+            batches.append([seed])
+    return batches
+
+
+def run_seeds(args):
+    # nengo is only imported when it is needed
+    from wta_semflu import SemFlu
+
+    seeds, params = args
+    if len(seeds) > 1:
+        params = dict(params, batch=len(seeds))
+    SemFlu().run(seed=seeds[0], **params)
+    return seeds
+
+
+def run_sweep(seeds, data_dir, processes=None, batch=1, **params):
+    """Runs SemFlu for every seed in `seeds` and stores results in `data_dir`.
+
+    Parameters
+    ----------
+    seeds : sequence of int
+        Seeds to simulate.
+    data_dir : str
+        Directory where pytry stores the results.
+    processes : int, optional
+        Number of worker processes, defaults to the number of CPUs.
+    batch : int, optional
+        Number of consecutive seeds simulated together in a single simulator
+        (see the batch parameter of SemFlu).
+    params : dict
+        Further parameters passed to `SemFlu.run`.
+
+    Returns
+    -------
+    list
+        Seeds that have been simulated in this call.
+    """
+    params.setdefault('results_store', os.path.join(data_dir, store_name))
+    create_store(params['results_store'], [data_dir])
+    done = finished_seeds(data_dir, store=params['results_store'], **params)
+    todo = [int(s) for s in seeds if int(s) not in done]
+    print('Seeds finished: {}, remaining: {}'.format(len(done), len(todo)))
+    if len(todo) == 0:
+        return []
+
+    params = dict(params, data_dir=data_dir)
+    jobs = [(seeds, params) for seeds in contiguous_batches(todo, batch)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        simulated = []
+        for seeds in pool.imap_unordered(run_seeds, jobs, chunksize=1):
+            simulated.extend(seeds)
+            print('Finished seeds {}-{} ({}/{})'.format(
+                seeds[0], seeds[-1], len(simulated), len(todo)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return simulated
+
+
+queue_name = 'sweep_queue.json'
+
+# parameters that determine the vocabulary and the cue to state transform
+# (together with the seed), see SemFlu.vocab_and_transform
+transform_params = ('amat', 'd', 'transform_rank')
+
+
+def spec_points(spec):
+    """Returns the parameter sets of a sweep spec.
+
+    The spec is a dict with the entries
+
+    params
+        Parameters that are the same for all points.
+    grid
+        Maps parameters to lists of values, every combination is a point.
+    random
+        Maps parameters to a list of values (sampled uniformly from the list)
+        or a dict with ``low`` and ``high`` (sampled uniformly from the
+        interval). ``samples`` sets are drawn (with the random state seeded by
+        ``sample_seed``) and combined with every grid point.
+
+    Returns
+    -------
+    list
+        (name, params) of every point, where name is built from the values of
+        the swept parameters.
+    """
+    grid = spec.get('grid', {})
+    grid_keys = sorted(grid)
+    grid_sets = [dict(zip(grid_keys, values)) for values in
+                 itertools.product(*[grid[k] for k in grid_keys])]
+
+    random = spec.get('random', {})
+    random_sets = [{}]
+    if len(random) > 0:
+        rng = np.random.RandomState(spec.get('sample_seed', 0))
+        random_sets = []
+        for _ in range(spec.get('samples', 1)):
+            sample = {}
+            for k in sorted(random):
+                values = random[k]
+                if isinstance(values, dict):
+                    sample[k] = float(
+                        rng.uniform(values['low'], values['high']))
+                else:
+                    sample[k] = values[rng.randint(len(values))]
+            random_sets.append(sample)
+
+    points = []
+    for g in grid_sets:
+        for r in random_sets:
+            swept = dict(g, **r)
+            name = '_'.join(
+                '{}{:g}'.format(k, v) if isinstance(v, float) else
+                '{}{}'.format(k, v) for k, v in sorted(swept.items()))
+            points.append((name or 'default',
+                           dict(spec.get('params', {}), **swept)))
+    return points
+
+
+def spec_seeds(spec):
+    """Returns the seeds of a sweep spec, given by ``seeds`` as list or as
+    number of seeds starting at 0."""
+    seeds = spec.get('seeds', 1)
+    if isinstance(seeds, int):
+        return list(range(seeds))
+    return [int(s) for s in seeds]
+
+
+def schedule(spec, data_dir, batch=1):
+    """Returns the jobs of a sweep that have not been simulated yet.
+
+    Every point of the spec is stored in its own sub-directory of `data_dir`.
+    The jobs are ordered such that jobs sharing the vocabulary and transform
+    (same `transform_params` and seeds) are adjacent, see `job_groups`.
+
+    Returns
+    -------
+    list
+        Dicts with the sub-directory (dir), the parameters (params) and the
+        seeds of every job.
+    """
+    jobs = []
+    seeds = spec_seeds(spec)
+    points = spec_points(spec)
+    create_store(os.path.join(data_dir, store_name),
+                 [os.path.join(data_dir, name) for name, _ in points])
+    for name, params in points:
+        done = finished_seeds(
+            os.path.join(data_dir, name),
+            store=params.get(
+                'results_store', os.path.join(data_dir, store_name)),
+            **params)
+        todo = [s for s in seeds if s not in done]
+        for batch_seeds in contiguous_batches(todo, batch):
+            jobs.append(dict(dir=name, params=params, seeds=batch_seeds))
+    jobs.sort(key=group_key)
+    return jobs
+
+
+def group_key(job):
+    params = job['params']
+    return (tuple(str(params.get(k)) for k in transform_params),
+            job['seeds'], job['dir'])
+
+
+def job_groups(jobs):
+    """Groups jobs that share the vocabulary and transform.
+
+    Each group is run by a single worker, so that only its first job has to
+    create the vocabulary and transform and the following jobs find them in
+    the transform cache.
+    """
+    return [list(group) for _, group in itertools.groupby(
+        sorted(jobs, key=group_key), key=lambda job: group_key(job)[:2])]
+
+
+def load_queue(data_dir):
+    with open(os.path.join(data_dir, queue_name), 'r') as f:
+        return json.load(f)
+
+
+def save_queue(data_dir, queue):
+    """Writes the queue file atomically (like cache.store_transform)."""
+    fd, tmp_file = tempfile.mkstemp(dir=data_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(queue, f, indent=1, sort_keys=True)
+        os.rename(tmp_file, os.path.join(data_dir, queue_name))
+    except:
+        os.remove(tmp_file)
+        raise
+
+
+def run_group(args):
+    jobs, data_dir = args
+    for job in jobs:
+        params = dict(
+            job['params'], data_dir=os.path.join(data_dir, job['dir']))
+        params.setdefault('transform_cache', os.path.join(data_dir, 'cache'))
+        params.setdefault(
+            'results_store', os.path.join(data_dir, store_name))
+        run_seeds((job['seeds'], params))
+    return jobs
+
+
+def run_grid(spec, data_dir, processes=None, batch=1):
+    """Runs the sweep described by `spec` (see `spec_points`).
+
+    If `data_dir` already contains a queue file, the sweep in it is resumed
+    and `spec` may be None; otherwise a new queue is created from `spec`.
+    The pending jobs are determined from the results in `data_dir`, so seeds
+    that already have results are skipped in both cases.
+
+    Parameters
+    ----------
+    spec : dict or None
+        Sweep spec.
+    data_dir : str
+        Directory of the sweep, with a sub-directory for every point.
+    processes : int, optional
+        Number of worker processes, defaults to the number of CPUs.
+    batch : int, optional
+        Number of consecutive seeds simulated together in a single simulator.
+
+    Returns
+    -------
+    list
+        Jobs that have been run in this call.
+    """
+    if spec is not None:
+        # compare and store the spec as it is read back from the queue file
+        spec = json.loads(json.dumps(spec))
+
+    if os.path.exists(os.path.join(data_dir, queue_name)):
+        queue = load_queue(data_dir)
+        if spec is not None and spec != queue['spec']:
+            raise ValueError(
+                "{} contains a different sweep.".format(data_dir))
+        jobs = schedule(queue['spec'], data_dir, queue['batch'])
+    elif spec is None:
+        raise ValueError("No sweep to resume in {}.".format(data_dir))
+    else:
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        queue = dict(spec=spec, batch=batch)
+        jobs = schedule(spec, data_dir, batch)
+
+    queue['pending'] = jobs
+    save_queue(data_dir, queue)
+    groups = job_groups(jobs)
+    print('Points: {}, jobs remaining: {} in {} groups'.format(
+        len(spec_points(queue['spec'])), len(jobs), len(groups)))
+    if len(jobs) == 0:
+        return []
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        finished = []
+        for group in pool.imap_unordered(
+                run_group, [(g, data_dir) for g in groups], chunksize=1):
+            finished.extend(group)
+            for job in group:
+                queue['pending'].remove(job)
+            save_queue(data_dir, queue)
+            print('Finished {} ({}/{} jobs)'.format(
+                ', '.join('{} seeds {}-{}'.format(
+                    job['dir'], job['seeds'][0], job['seeds'][-1])
+                    for job in group), len(finished), len(jobs)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return finished
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'spec', nargs='?', type=str, default=None,
+        help="JSON file with the sweep spec")
+    parser.add_argument(
+        'data_dir', type=str, help="Directory of the sweep")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="Resume the sweep in data_dir (no spec needed)")
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help="Number of parallel simulations (default: number of CPUs)")
+    parser.add_argument(
+        '--batch', type=int, default=1,
+        help="Number of seeds simulated together in one simulator")
+    args = parser.parse_args()
+
+    spec = None
+    if args.spec is not None:
+        with open(args.spec, 'r') as f:
+            spec = json.load(f)
+    elif not args.resume:
+        parser.error("a spec is needed unless --resume is given")
+
+    run_grid(spec, args.data_dir, processes=args.processes, batch=args.batch)
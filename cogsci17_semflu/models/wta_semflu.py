@@ -4,54 +4,135 @@ import os
 import os.path
 import pdb
 import pytry
+import time
 
 from nengo import spa
 from nengo.utils import numpy as npext
-from cogsci17_semflu import fan
+from cogsci17_semflu import cache, fan, results
+from cogsci17_semflu.model_params import model_params
+from cogsci17_semflu.profiling import PhaseTimer, phases_suffix
+from cogsci17_semflu.spikes import SpikeRecorder
 
 
 class SemFlu(pytry.NengoTrial):
+    def __init__(self):
+        super(SemFlu, self).__init__()
+        self.timer = PhaseTimer()
+
     def params(self):
-        self.param('word vector dimensions', d=64)
-        self.param('cue connection feedback strength', c_fs=.2)
-        self.param('state connection feedback strength', s_fs=1.)
-        self.param('cue to state connection strength', cs_s=3)
-        self.param('simulation length', sim_len=5)
-        self.param('association matrix', amat='ngram_mat')
-        self.param('cue state synapse', cs_syn=0.005)
-        self.param('response to response magnitude synapse', rspm_syn=0.005)
-        self.param('wta to response synapse', wtar_syn=0.1)
-        self.param('inhibitory connection', inh_st=-5)
-        self.param('wta threshold', wta_th=0.3)
+        model_params(self)
 
         self.param('record and save spikes to file', save_spikes='')
+        self.param('transform cache directory', transform_cache='')
+        self.param('number of seeds simulated together', batch=1)
+        self.param(
+            'stop after this many distinct responses (0: never)',
+            max_responses=0)
+        self.param(
+            'stop if there was no response for this long (0: never)',
+            idle_stop=0.)
+        self.param('length of simulation chunks when stopping early',
+                   stop_chunk=0.5)
+        self.param('write phase timings next to the results', profile=False)
+        self.param('results store to append the results to',
+                   results_store='')
+        self.param(
+            'rank of the association matrix approximation used for the '
+            'transform (0: exact)', transform_rank=0)
+        self.param('decode the responses every this many timesteps',
+                   sample_every=1)
+        self.param('decode the responses in single precision',
+                   decode_float32=False)
+
+    def run(self, **kwargs):
+        # see cogsci17_semflu.profiling
+        self.timer = PhaseTimer()
+        result = super(SemFlu, self).run(**kwargs)
+
+        p = self.p
+        if p.results_store != '' and result is not None:
+            self.store_results(p, result)
+        if p.profile:
+            self.timer.add('write', time.time() - self.evaluated)
+            self.timer.write(
+                os.path.join(p.data_dir, p.data_filename + phases_suffix),
+                seed=p.seed, batch=p.batch, stop_time=self.stop_time)
+        return result
+
+    def store_results(self, p, result):
+        """Appends the parameters and results of a run to the results store
+        `p.results_store`, one row per seed (see cogsci17_semflu.results).
+        """
+        results.append_trial(p.results_store, self, p, result)
 
     def model(self, p):
-        d = p.d
-        c_fs = p.c_fs
-
         data_dir = os.path.join(
             os.path.dirname(__file__),
             os.pardir, os.pardir, 'association_data')
 
-        with spa.SPA(seed=p.seed) as model:
-
-            # Load association data
-            assoc_mat, i2w, _ = fan.load_assoc_mat(data_dir, p.amat)
+        # Load association data
+        with self.timer.phase('load_assoc'):
+            assoc_mat, i2w, _ = fan.load_assoc_mat(
+                data_dir, p.amat, mmap_mode='r')
             i2w = [i.upper() for i in i2w]
+            mat_file = fan.assoc_mat_file(data_dir, p.amat)
+        self.assoc_factors = None  # see low_rank_assoc
+
+        if p.batch > 1:
+            if p.save_spikes != '':
+                raise ValueError("Cannot save spikes of batched runs.")
+
+            # independent copies of the model for the seeds p.seed,
+            # p.seed + 1, ..., simulated together
+            self.decoders = []
+            with nengo.Network(seed=p.seed) as model:
+                for seed in range(p.seed, p.seed + p.batch):
+                    _, _, decoder = self.semflu_network(
+                        p, seed, assoc_mat, i2w, mat_file)
+                    self.decoders.append(decoder)
+            # the simulator is built by pytry after model() returns
+            self.timer.start('build')
+            return model
+
+        model, self.vocab, self.decoder = self.semflu_network(
+            p, p.seed, assoc_mat, i2w, mat_file)
+        self.decoders = [self.decoder]
 
-            # Create vectors
-            self.vocab = fan.gen_spa_vocab(dimensions=d, word_list=i2w)
+        if p.save_spikes != '':
+            with model:
+                self.p_cue = nengo.Probe(model.cue.output, synapse=0.03)
+                self.spike_recorder = SpikeRecorder.connect(
+                    p.save_spikes, [
+                        ('cue', model.cue.state_ensembles.ensembles),
+                        ('bg_gpi', model.bg.gpi.ensembles)], p.dt)
+
+        self.timer.start('build')
+        return model
+
+    def semflu_network(self, p, seed, assoc_mat, i2w, mat_file):
+        """Builds the network for a single seed.
+
+        Returns
+        -------
+        tuple
+            (model, vocab, decoder) with the spa.SPA network, its vocabulary
+            and the ResponseDecoder that collects its responses.
+        """
+        d = p.d
+        c_fs = p.c_fs
 
-            vocab2 = self.vocab.create_subset(i2w)
+        with spa.SPA(seed=seed) as model:
 
-            # Transformation matrix
-            tr = np.dot(self.vocab.vectors.T,
-                        np.dot(assoc_mat.T, self.vocab.vectors))
+            # Create vectors and transformation matrix
+            vocab, tr = self.vocab_and_transform(
+                p, seed, assoc_mat, i2w, mat_file)
+
+            self.timer.start('network')
+            vocab2 = vocab.create_subset(i2w)
 
             # Cue ensemble
             model.cue = spa.State(
-                vocab=self.vocab, dimensions=d, feedback=c_fs)
+                vocab=vocab, dimensions=d, feedback=c_fs)
 
             # State ensemble
             model.state = spa.State(
@@ -66,7 +147,7 @@ class SemFlu(pytry.NengoTrial):
                 wta_synapse=0.01, threshold=p.wta_th)
 
             model.response = spa.AssociativeMemory(
-                input_vocab=self.vocab, wta_output=True)
+                input_vocab=vocab, wta_output=True)
 
             nengo.Connection(
                 model.wta.output, model.response.input, synapse=p.wtar_syn,
@@ -100,74 +181,204 @@ class SemFlu(pytry.NengoTrial):
 
             model.input = spa.Input(goal=lambda t: 'INIT' if t < 0.05 else '0')
 
-            self.probe_response = nengo.Probe(
-                model.response.output, synapse=0.03)
+            # decode responses while the model runs instead of probing
+            decoder = ResponseDecoder(
+                vocab, sample_every=p.sample_every,
+                dtype=np.float32 if p.decode_float32 else np.float64,
+                dt=p.dt)
+            model.decoder = nengo.Node(decoder, size_in=d)
+            nengo.Connection(
+                model.response.output, model.decoder, synapse=0.03)
 
             for obj in model.all_objects:
-                rng = np.random.RandomState(p.seed)
+                rng = np.random.RandomState(seed)
                 if obj.seed is None:
                     obj.seed = rng.randint(npext.maxint)
 
-            if p.save_spikes != '':
-                self.p_cue = nengo.Probe(model.cue.output, synapse=0.03)
-                self.p_cue_spikes = [
-                    nengo.Probe(e.neurons, 'spikes')
-                    for e in model.cue.state_ensembles.ensembles]
-                self.p_bg_gpi_spikes = [
-                    nengo.Probe(e.neurons, 'spikes')
-                    for e in model.bg.gpi.ensembles]
-
-        return model
+        return model, vocab, decoder
+
+    def simulate(self, p, sim):
+        """Runs the simulation for `p.sim_len` seconds.
+
+        If `p.max_responses` or `p.idle_stop` is set, the simulation is run in
+        chunks of `p.stop_chunk` seconds and stops after the chunk in which all
+        seeds reached `p.max_responses` distinct responses or had no response
+        for `p.idle_stop` seconds. Up to that point the results are the same as
+        for a run of the full length.
+        """
+        steps = int(np.round(p.sim_len/sim.dt))
+        if p.max_responses <= 0 and p.idle_stop <= 0:
+            sim.run_steps(steps)
+            return
+
+        chunk = max(int(np.round(p.stop_chunk/sim.dt)), 1)
+        while sim.n_steps < steps:
+            sim.run_steps(min(chunk, steps - sim.n_steps))
+            if all(self.done(p, dec, sim.time) for dec in self.decoders):
+                break
+
+    def done(self, p, decoder, t):
+        """Whether the responses of `decoder` at time `t` allow to stop."""
+        if (p.max_responses > 0 and
+                len(set(decoder.responses)) >= p.max_responses):
+            return True
+        last_time = 0. if decoder.last_time is None else decoder.last_time
+        return p.idle_stop > 0 and 1000*t - last_time >= 1000*p.idle_stop
+
+    def vocab_and_transform(self, p, seed, assoc_mat, i2w, mat_file):
+        """Returns the vocabulary and the cue to state transform.
+
+        Both only depend on the association matrix, the dimensionality, the
+        seed and the word list. If `p.transform_cache` is set, they are looked
+        up in (and stored to) the cache in that directory.
+        """
+        if p.transform_cache != '':
+            with self.timer.phase('transform_cache'):
+                key = cache.transform_key(
+                    cache.file_hash(mat_file), p.d, seed, i2w,
+                    rank=p.transform_rank)
+                entry = cache.load_transform(p.transform_cache, key)
+                if entry is not None:
+                    keys, vectors, tr = entry
+                    return fan.vocab_from_vectors(keys, vectors), tr
+
+        # pytry seeds the global random state with the seed of a run, so an
+        # explicit RandomState gives the same vectors
+        with self.timer.phase('vocab'):
+            vocab = fan.gen_spa_vocab(
+                dimensions=p.d, word_list=i2w,
+                rng=np.random.RandomState(seed))
+        if p.transform_rank > 0:
+            u, s, vt = self.low_rank_assoc(p, assoc_mat)
+            with self.timer.phase('transform'):
+                tr = fan.low_rank_transform(vocab.vectors, u, s, vt)
+        else:
+            with self.timer.phase('transform'):
+                tr = fan.assoc_transform(vocab.vectors, assoc_mat)
+
+        if p.transform_cache != '':
+            with self.timer.phase('transform_cache'):
+                cache.store_transform(
+                    p.transform_cache, key, vocab.keys, vocab.vectors, tr)
+
+        return vocab, tr
+
+    def low_rank_assoc(self, p, assoc_mat):
+        """Returns the factors (u, s, vt) of the rank `p.transform_rank`
+        approximation of the association matrix, computed once per model.
+        """
+        if self.assoc_factors is None:
+            with self.timer.phase('low_rank'):
+                u, s, vt, _ = fan.low_rank_assoc(assoc_mat, p.transform_rank)
+            self.assoc_factors = (u, s, vt)
+        return self.assoc_factors
 
     def evaluate(self, p, sim, plt):
+        self.timer.stop()  # build
+        self.p = p
+
         with sim:
-            sim.run(p.sim_len)
+            with self.timer.phase('simulate'):
+                self.simulate(p, sim)
+            self.stop_time = float(sim.time)
+        self.timer.add('decode', sum(dec.seconds for dec in self.decoders))
 
         if p.save_spikes != '':
-            np.savez(
-                p.save_spikes, 
-                t=sim.trange(),
-                cue_decoded=spa.similarity(sim.data[self.p_cue], self.vocab),
-                cue=np.concatenate(
-                    [sim.data[p] for p in self.p_cue_spikes], axis=1),
-                bg_gpi=np.concatenate(
-                    [sim.data[p] for p in self.p_bg_gpi_spikes], axis=1))
-
-        min_sim = 0.8   # discard responses while model initializes
-        similarities = spa.similarity(
-            sim.data[self.probe_response], self.vocab)
-
-        mid = np.argmax(similarities, axis=1)
-        sim_max = np.max(similarities, axis=1)
-
-        responses = mid[sim_max > min_sim]
-        timing = 1000*sim.trange()[sim_max > min_sim]
-
-        if len(responses) > 0:
-            current = responses[0]
-    
-            out_responses = [self.vocab.keys[current].lower()]
-            out_time = [timing[0]]
-            last_time = timing[0]  # needed for computing irt
-    
-            for idx in range(len(responses)-1):
-                if responses[idx] != responses[idx+1]:
-                    current = responses[idx+1]
-                    word = self.vocab.keys[current]
-    
-                    if word not in ['ANIMAL']:
-                        delta_t = timing[idx+1]-last_time
-                        out_time.append(delta_t)
-                        out_responses.append(word.lower())
-                        last_time = timing[idx+1]
-        else:
-            out_responses = []
-            out_time = []
+            # spikes are read with cogsci17_semflu.spikes.SpikeFile
+            with self.timer.phase('save_spikes'):
+                self.spike_recorder.close(
+                    t=sim.trange(), cue_decoded=spa.similarity(
+                        sim.data[self.p_cue], self.vocab))
+
+        self.evaluated = time.time()
+
+        if p.batch > 1:
+            return {
+                'seeds': list(range(p.seed, p.seed + p.batch)),
+                'responses': [dec.responses for dec in self.decoders],
+                'irt': [dec.irt for dec in self.decoders]
+                }
 
         return {
-            'responses': out_responses,
-            'irt': out_time
+            'responses': self.decoder.responses,
+            'irt': self.decoder.irt
             }
 
+
+class ResponseDecoder(object):
+    """Extracts the responses of the model while it is simulated.
+
+    Used as the function of a nengo.Node that receives the (filtered) output
+    of the response state. Every timestep (or every `sample_every` timesteps)
+    the best matching word is determined. Whenever it changes, the word and
+    the time since the previous response (in ms) are recorded, so that memory
+    use does not depend on the simulation length.
+
+    Parameters
+    ----------
+    vocab : spa.Vocabulary
+        Vocabulary of the response state.
+    min_sim : float, optional
+        Timesteps where no word is more similar than this are ignored, which
+        discards responses while the model initializes.
+    skip : sequence of str, optional
+        Words that are not reported as responses (except for the very first).
+    sample_every : int, optional
+        Only the timesteps that are a multiple of this are decoded. This can
+        delay responses by more than ``sample_every - 1`` timesteps, because
+        the noisy similarity of a word can drop below `min_sim` again after
+        first exceeding it (in one check the largest IRT difference was 5 ms
+        for ``sample_every=2`` and 12 ms for ``sample_every=5``); measure the
+        differences for a parameter set with
+        benchmarks/check_response_decimation.py.
+    dtype : numpy.dtype, optional
+        Precision of the similarities.
+    dt : float, optional
+        Timestep of the simulator, used to find the timesteps to decode.
+    """
+
+    def __init__(self, vocab, min_sim=0.8, skip=('ANIMAL',), sample_every=1,
+                 dtype=np.float64, dt=0.001):
+        self.vectors = np.asarray(vocab.vectors, dtype=dtype)
+        self.keys = vocab.keys
+        self.min_sim = min_sim
+        self.skip = skip
+        self.sample_every = sample_every
+        self.dt = dt
+
+        self.current = None
+        self.last_time = None  # needed for computing irt
+        self.responses = []
+        self.irt = []
+        self.seconds = 0.  # time spent decoding
+
+    def __call__(self, t, x):
+        # the node also calls this once at t=0 when it is created
+        step = int(round(t/self.dt))
+        if step <= 0 or step % self.sample_every != 0:
+            return
+        t0 = time.time()
+        self.decode(t, x)
+        self.seconds += time.time() - t0
+
+    def decode(self, t, x):
+        similarities = np.dot(self.vectors, x.astype(self.vectors.dtype))
+        idx = np.argmax(similarities)
+        if similarities[idx] <= self.min_sim or idx == self.current:
+            return
+
+        time = 1000*t
+        word = self.keys[idx]
+        if self.current is None:
+            self.responses.append(word.lower())
+            self.irt.append(time)
+            self.last_time = time
+        elif word not in self.skip:
+            self.responses.append(word.lower())
+            self.irt.append(time - self.last_time)
+            self.last_time = time
+        self.current = idx
+
+
 if __name__ == '__builtin__':
     model = SemFlu().make_model(d=256, seed=12)
@@ -10,8 +10,6 @@ from copy import deepcopy
 import numpy as np
 import os
 
-from cogsci17_semflu.fan import load_animal_categories
-
 try:
     import cPickle as pickle
 except ImportError:
@@ -20,7 +18,50 @@ except ImportError:
 animal_path = os.path.join(
     os.path.dirname(__file__), os.pardir, 'animal_data', 'animal_cat_dicts.pkl')
 
-category_to_animal, animal_to_category = load_animal_categories(animal_path)
+# loaded on first use, see animal_categories and category_table
+_animal_categories = None
+_category_table = None
+
+
+def animal_categories():
+    """
+    Returns (category_to_animal, animal_to_category), loaded from animal_path
+    when first needed.
+    """
+    global _animal_categories
+    if _animal_categories is None:
+        # fan needs pandas and scipy, which are slow to import
+        from cogsci17_semflu.fan import load_animal_categories
+        _animal_categories = load_animal_categories(animal_path)
+    return _animal_categories
+
+
+def category_table():
+    """
+    Returns (categories, animal_ids, category_mask) with the sorted list of
+    categories and the lookup of category_lookup, built when first needed.
+    """
+    global _category_table
+    if _category_table is None:
+        category_to_animal, animal_to_category = animal_categories()
+        categories = sorted(category_to_animal.keys())
+        _category_table = (categories,) + category_lookup(
+            animal_to_category, categories)
+    return _category_table
+
+
+def category_lookup(animal_to_category, categories):
+    """
+    Returns a dict mapping every animal to a row index and a boolean
+    animals x categories matrix that marks the categories of each animal.
+    """
+    cat_index = {cat: i for i, cat in enumerate(categories)}
+    animal_ids = {}
+    mask = np.zeros((len(animal_to_category), len(categories)), dtype=bool)
+    for i, (animal, cats) in enumerate(sorted(animal_to_category.items())):
+        animal_ids[animal] = i
+        mask[i, [cat_index[cat] for cat in cats]] = True
+    return animal_ids, mask
 
 #TODO: can also try a heuristic with whatever category 'reaches out the furthest'
 def get_category_switches_heuristic(sp_list, time_list):
@@ -28,49 +69,170 @@ def get_category_switches_heuristic(sp_list, time_list):
     Always picks the first biggest category it sees. May not always be 'correct'
     but should be decent
     """
-    cat_matrix = build_categorization_matrix(sp_list, animal_to_category,
-                                             category_to_animal, unfold_matrix=False)
-    sol_matrix = np.zeros(cat_matrix.shape)
-    
-    num_categories = len(category_to_animal.keys())
-    wi = 0
-    while wi < len(sp_list):
-        longest = 0
-        best_category = -1
-        best_bounds = [-1,-1]
-        for ci in range(num_categories):
-            if cat_matrix[ci,wi] == 1:
-                bounds = get_bounds(wi, cat_matrix[ci,:])
-                length = bounds[1] - bounds[0] + 1
-                if length > longest:
-                    longest = length
-                    best_category = ci
-                    best_bounds = bounds
-        sol_matrix[best_category, best_bounds[0]:best_bounds[1]+1] = 1
-        wi = best_bounds[1]+1
-    
-    
-    # Convert the solution matrix into the correct form of output
-    si = 0 # switch index, the final value will be the number of category switches
-    time_lists = []
-    animal_lists = []
-    active_indices = [] # keep track of which category indices are being written
-    cs_map = {} # mapping of category index to switch index
-    num_categories = len(category_to_animal.keys())
-    for wi, (sp, tp) in enumerate(zip(sp_list, time_list)):
-        # find all category indices that have a '1' in the solution matrix for the current word
-        indices = np.where(sol_matrix[:,wi]==1)[0]
-        for i in indices:
-            if i in active_indices:
-                animal_lists[cs_map[i]].append(sp)
-                time_lists[cs_map[i]].append(tp)
-            else:
-                cs_map[i] = si
-                animal_lists.append([sp])
-                time_lists.append([tp])
-                si += 1
-        active_indices = list(indices)
+    return get_category_switches_heuristic_batch([sp_list], [time_list])[0]
+
+def get_category_switches_heuristic_batch(sp_lists, time_lists):
+    """
+    Applies get_category_switches_heuristic to many response sequences (e.g.
+    all simulations or all participants) at once and returns a list with a
+    (time_lists, animal_lists) tuple for every sequence.
+
+    The sequences are segmented together with segment_heuristic, only the
+    split into lists is done per sequence.
+    """
+    ids, lengths = response_ids(sp_lists)
+    lower, upper = segment_heuristic(categorization_tensor(ids), lengths)
+
+    results = []
+    for sp_list, time_list, lo_row, up_row in zip(
+            sp_lists, time_lists, lower, upper):
+        clusters = [(lo, up + 1) for lo, up in zip(lo_row, up_row) if lo >= 0]
+        results.append((
+            [list(time_list[lo:hi]) for lo, hi in clusters],
+            [list(sp_list[lo:hi]) for lo, hi in clusters]))
+
+    return results
+
+def response_ids(sp_lists):
+    """
+    Returns (ids, lengths) for the ragged response sequences `sp_lists`: a
+    sequences x positions array with the row of every response in the
+    category lookup of category_table (-1 after the end of a sequence) and
+    the length of every sequence.
+    """
+    _, animal_ids, _ = category_table()
+
+    lengths = np.array([len(sp_list) for sp_list in sp_lists], dtype=int)
+    n_positions = np.max(lengths) if len(lengths) > 0 else 0
+    ids = np.full((len(lengths), n_positions), -1, dtype=int)
+    ids[np.arange(n_positions) < lengths[:, None]] = [
+        animal_ids[sp] for sp_list in sp_lists for sp in sp_list]
+    return ids, lengths
 
+def categorization_tensor(ids):
+    """
+    Returns a boolean sequences x categories x positions tensor that marks
+    the categories of every response in `ids` (see response_ids), the
+    categories being ordered like those of category_table. Positions after
+    the end of a sequence belong to no category.
+    """
+    categories, _, category_mask = category_table()
+
+    cat_tensor = np.zeros(
+        (ids.shape[0], ids.shape[1], len(categories)), dtype=bool)
+    valid = ids >= 0
+    cat_tensor[valid] = category_mask[ids[valid]]
+    return cat_tensor.transpose(0, 2, 1)
+
+def segment_heuristic(cat_tensor, lengths):
+    """
+    Segments every sequence of the categorization tensor `cat_tensor` (see
+    categorization_tensor) like get_category_switches_heuristic.
+
+    Starting from the first word, the first category with the longest run of
+    ones that contains the word is chosen and the segmentation continues
+    after that run. The runs of all positions of all sequences are found with
+    array operations and the jumps from one chosen run to the next are done
+    for all sequences at once.
+
+    Returns
+    -------
+    tuple
+        (lower, upper), sequences x patches arrays with the first and last
+        position of every patch (cluster), -1 after the last patch of a
+        sequence. A patch may start before the end of the previous one, the
+        words in between then belong to both.
+    """
+    n_seqs, _, n_positions = cat_tensor.shape
+    valid = np.arange(n_positions) < lengths[:, None]
+    uncategorized = valid & ~np.any(cat_tensor, axis=1)
+    if np.any(uncategorized):
+        seq, pos = np.argwhere(uncategorized)[0]
+        raise ValueError(
+            "Response {} of sequence {} does not belong to any "
+            "category.".format(pos, seq))
+
+    lower, upper = run_bounds(cat_tensor)
+    run_length = upper - lower + 1
+    # get_bounds reports runs reaching the end of a sequence one word longer
+    run_length[upper == (lengths - 1)[:, None, None]] += 1
+    run_length[~cat_tensor] = 0
+
+    # first category with the longest run for every position
+    best = np.argmax(run_length, axis=1)
+    index = (np.arange(n_seqs)[:, None], best, np.arange(n_positions))
+    best_lower, best_upper = lower[index], upper[index]
+
+    patch_lower = np.full((n_seqs, n_positions), -1, dtype=int)
+    patch_upper = np.full((n_seqs, n_positions), -1, dtype=int)
+    seqs = np.arange(n_seqs)
+    n_patches = np.zeros(n_seqs, dtype=int)
+    pos = np.zeros(n_seqs, dtype=int)
+    active = pos < lengths
+    while np.any(active):
+        seq = seqs[active]
+        patch_lower[seq, n_patches[seq]] = best_lower[seq, pos[seq]]
+        patch_upper[seq, n_patches[seq]] = best_upper[seq, pos[seq]]
+        n_patches[seq] += 1
+        pos[seq] = best_upper[seq, pos[seq]] + 1
+        active = pos < lengths
+
+    n_max = np.max(n_patches) if n_seqs > 0 else 0
+    return patch_lower[:, :n_max], patch_upper[:, :n_max]
+
+def patch_rows(lower, upper):
+    """
+    Returns a dict of arrays with one entry per word of every patch of
+    segment_heuristic, ordered by sequence, patch and position:
+
+        sequence        index of the sequence
+        position        position of the word in the sequence
+        patch           number of the patch in the sequence, from 1
+        item            position of the word in the patch, from 1
+        items_from_end  position of the word in the patch from its end, from 1
+
+    The size of a patch is ``upper - lower + 1`` and the number of category
+    switches of a sequence is its number of patches minus one.
+    """
+    n_seqs, n_patches = lower.shape
+    sizes = np.where(lower >= 0, upper - lower + 1, 0).ravel()
+    n = int(np.sum(sizes))
+    item = np.arange(n) - np.repeat(np.cumsum(sizes) - sizes, sizes) + 1
+    return {
+        'sequence': np.repeat(np.arange(n_seqs), sizes.reshape(
+            n_seqs, n_patches).sum(axis=1)),
+        'position': np.repeat(lower.ravel(), sizes) + item - 1,
+        'patch': np.repeat(np.tile(np.arange(1, n_patches+1), n_seqs), sizes),
+        'item': item,
+        'items_from_end': np.repeat(sizes, sizes) - item + 1,
+    }
+
+def solution_to_lists(sol_matrix, sp_list, time_list):
+    """
+    Converts the solution matrix into lists of times and animals, one list for
+    every contiguous run of ones in the solution matrix (i.e. every cluster).
+    Clusters are ordered by the position of their first word and the category
+    index, a word covered by two runs appears in both clusters.
+    """
+    num_categories = sol_matrix.shape[0]
+    wi, ci = np.nonzero(sol_matrix.T)  # ordered by word, then by category
+    if len(wi) == 0:
+        return [], []
+
+    # a run of ones starts a new cluster (switch) unless it continues the
+    # category of the previous word
+    lower, _ = run_bounds(sol_matrix)
+    new = lower[ci, wi] == wi
+    start_keys = (wi*num_categories + ci)[new]
+    cluster = np.searchsorted(
+        start_keys, lower[ci, wi]*num_categories + ci)
+
+    order = np.argsort(cluster, kind='mergesort')
+    splits = np.cumsum(np.bincount(cluster))[:-1]
+    time_lists = [[time_list[i] for i in w]
+                  for w in np.split(wi[order], splits)]
+    animal_lists = [[sp_list[i] for i in w]
+                    for w in np.split(wi[order], splits)]
     return time_lists, animal_lists
 
 def build_categorization_matrix(sp_list, animal_to_category, 
@@ -78,13 +240,13 @@ def build_categorization_matrix(sp_list, animal_to_category,
 
     # Create an ordered list of all of the categories
     # This will be used to index into the matrix
-    categories = category_to_animal.keys()
-    categories.sort()
+    cat_index = {
+        cat: i for i, cat in enumerate(sorted(category_to_animal.keys()))}
 
-    cat_matrix = np.zeros((len(categories), len(sp_list)))
+    cat_matrix = np.zeros((len(cat_index), len(sp_list)))
     for i, sp in enumerate(sp_list):
         for cat in animal_to_category[sp]:
-            cat_matrix[categories.index(cat),i] = 1
+            cat_matrix[cat_index[cat],i] = 1
 
     # If a category ends and then is repeated later on, extend it to a new row to make
     # processing easier. Its new index will be 'old_index' + '# of repeats'*'len(categories)'
@@ -129,40 +291,10 @@ def get_category_switches(sp_list, animal_to_category, category_to_animal):
     #print("Starting Matrix")
     #print(cat_matrix)
 
-    # Do some form of optimization to come up with the best category mapping from the data
-
-    # Brute forcing it for now, there should be a better way to do this
-    sol_matrix = np.zeros(cat_matrix.shape)
-    solutions = cat_mat_sol(0, sol_matrix, cat_matrix)
-    """
-    print("PRINTING SOLUTIONS")
-    for s in solutions:
-        print(s)
-        print("")
-
-    print("COMPLETE!")
-    """
-    # Find the best solution from the list
+    # Find the best category mapping from the data
     # The first metric is the least number of category switches (i.e. minimize rows used)
     # If there is a tie, the solution with the most entries in each category wins (i.e. maximize sum(sol_matrix))
-    # If there is still a tie, pick one at random?
-
-    sol_score = np.zeros((len(solutions),3))
-    best_val = 0
-    best_index = -1
-    for i, s in enumerate(solutions):
-        # Calculate scores in a way that both metrics should be maximized
-        sol_score[i,0] = s.shape[0] - np.count_nonzero(np.sum(s, axis=1)) #TODO: pick the right axis
-        sol_score[i,1] = np.sum(np.sum(s))
-        sol_score[i,2] = sol_score[i,0]*1000000+sol_score[i,1] # lazy combined metric
-
-        if sol_score[i,2] > best_val:
-            best_val = sol_score[i,2]
-            best_index = i
-
-    best_sol = solutions[best_index]
-    #print("Best solution:")
-    #print(best_sol)
+    best_sol = optimal_segmentation(cat_matrix)
 
     # Convert the solution matrix into the correct form of output
     si = 0 # switch index, the final value will be the number of category switches
@@ -187,6 +319,75 @@ def get_category_switches(sp_list, animal_to_category, category_to_animal):
 
     return category_lists, animal_lists
 
+def run_bounds(cat_mat):
+    """
+    Returns two arrays with the shape of cat_mat giving for every entry the
+    first and last column of the contiguous run of ones it belongs to (only
+    meaningful where cat_mat is 1). Same as get_bounds for all entries at once.
+    The runs are along the last axis, so cat_mat may also be a categorization
+    tensor.
+    """
+    ones = cat_mat == 1
+    n_cols = cat_mat.shape[-1]
+    cols = np.arange(n_cols)
+
+    starts = ones.copy()
+    starts[..., 1:] &= ~ones[..., :-1]
+    lower = np.maximum.accumulate(np.where(starts, cols, -1), axis=-1)
+
+    ends = ones.copy()
+    ends[..., :-1] &= ~ones[..., 1:]
+    upper = np.minimum.accumulate(
+        np.where(ends, cols, n_cols)[..., ::-1], axis=-1)[..., ::-1]
+
+    return lower, upper
+
+def optimal_segmentation(cat_mat):
+    """
+    Returns the solution matrix with the least category switches (rows used)
+    and, among those, the most entries. Ties are broken like the exhaustive
+    search of cat_mat_sol, preferring lower row indices for earlier words.
+
+    Starting from a word, a segmentation picks a row with a one for that word,
+    adds the whole contiguous run of ones of that row and continues after the
+    run. The best segmentation of the words from index wi onwards only depends
+    on wi, so dynamic programming from the end finds it in
+    O(rows * words) time.
+    """
+    n_rows, n_cols = cat_mat.shape
+    lower, upper = run_bounds(cat_mat)
+    length = upper - lower + 1
+
+    # best (switches, entries) for the words from index wi onwards
+    switches = np.full(n_cols+1, np.inf)
+    entries = np.zeros(n_cols+1)
+    choice = np.full(n_cols, -1, dtype=int)
+    switches[n_cols] = 0
+
+    weight = n_rows*n_cols + 1  # entries never exceed this
+    for wi in reversed(range(n_cols)):
+        rows = np.where(cat_mat[:, wi] == 1)[0]
+        nxt = upper[rows, wi] + 1
+        cost = (switches[nxt]+1)*weight - (entries[nxt]+length[rows, wi])
+        if len(rows) == 0 or np.isinf(np.min(cost)):
+            continue  # no segmentation possible from here
+        best = np.argmin(cost)  # first minimum, i.e. lowest row index
+        choice[wi] = rows[best]
+        switches[wi] = switches[nxt[best]] + 1
+        entries[wi] = entries[nxt[best]] + length[rows[best], wi]
+
+    if n_cols > 0 and choice[0] < 0:
+        raise ValueError("Some words do not belong to any category.")
+
+    sol_mat = np.zeros(cat_mat.shape)
+    wi = 0
+    while wi < n_cols:
+        ci = choice[wi]
+        sol_mat[ci, lower[ci, wi]:upper[ci, wi]+1] = 1
+        wi = upper[ci, wi] + 1
+    return sol_mat
+
+# Exhaustive search over all segmentations, superseded by optimal_segmentation
 #TODO: make sure nothing is passed by reference, or things could go horribly wrong
 def cat_mat_sol(wi, sol_mat, cat_mat):
 
@@ -0,0 +1,178 @@
+"""
+Timing and peak memory of the phases of a model run.
+
+SemFlu records the time and the peak resident memory after each phase of a
+run (loading the association matrix, creating the vocabulary and transform,
+creating the network, building and simulating the model, decoding the
+responses and writing the results). The responses are decoded while the model
+is simulated, so the decoding time is also part of the simulation time. With
+its ``profile`` parameter set, the records are written next to the pytry
+result as ``<data_filename>.phases.json`` (pytry.read ignores these files).
+The records of a sweep are summarized with
+
+    python profiling.py <data_dir>
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+phases_suffix = '.phases.json'
+
+
+def to_json(obj):
+    """Converts numpy scalars (and 0-d arrays like nengo's Simulator.time),
+    which json cannot serialize, to Python numbers."""
+    if isinstance(obj, (np.generic, np.ndarray)) and np.ndim(obj) == 0:
+        return obj.item()
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def max_rss():
+    """Returns the peak resident memory of the process in bytes, or None if it
+    cannot be determined."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return rss if sys.platform == 'darwin' else 1024*rss
+
+
+class PhaseTimer(object):
+    """Records the wall time and the peak memory of consecutive phases.
+
+    A phase lasts from `start` to `stop` (or to the start of the next phase),
+    or is given as a block with ``with timer.phase(name):``. Every phase
+    appends a record with its name, its duration in seconds, the peak
+    resident memory of the process at its end and the increase of the peak
+    during the phase (both in bytes). Phases can occur several times, e.g.
+    creating the vocabulary for every seed of a batch.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.current = None
+
+    def start(self, name):
+        self.stop()
+        self.current = (name, time.time(), max_rss())
+
+    def stop(self):
+        if self.current is None:
+            return
+        name, t0, rss0 = self.current
+        self.current = None
+        rss = max_rss()
+        self.records.append(dict(
+            phase=name, seconds=time.time() - t0, max_rss=rss,
+            rss_increase=None if rss is None else rss - rss0))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def add(self, name, seconds):
+        """Adds a phase that was timed elsewhere (without memory)."""
+        self.records.append(dict(
+            phase=name, seconds=seconds, max_rss=None, rss_increase=None))
+
+    def write(self, filename, **info):
+        """Writes the records and further `info` (e.g. the seed) as JSON."""
+        # serialize before opening the file, so errors leave no partial file
+        data = json.dumps(dict(info, phases=self.records), indent=1,
+                          sort_keys=True, default=to_json)
+        with open(filename, 'w') as f:
+            f.write(data)
+
+
+def load_phases(path):
+    """Reads all phase records in `path` and its sub-directories.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per record with the columns of the records and the directory
+        (relative to `path`) and file they were read from.
+    """
+    rows = []
+    for root, _, files in os.walk(path):
+        for fn in sorted(files):
+            if not fn.endswith(phases_suffix):
+                continue
+            with open(os.path.join(root, fn), 'r') as f:
+                data = json.load(f)
+            for record in data['phases']:
+                rows.append(dict(
+                    record, dir=os.path.relpath(root, path),
+                    run=fn[:-len(phases_suffix)]))
+    return pd.DataFrame(
+        rows, columns=['dir', 'run', 'phase', 'seconds', 'max_rss',
+                       'rss_increase'])
+
+
+def phase_report(df):
+    """Summarizes phase records (see `load_phases`) per phase.
+
+    Returns
+    -------
+    pandas.DataFrame
+        For every phase: number of runs, mean, standard deviation and total
+        of the time per run, the fraction of the total time of all phases
+        (decode is not counted, it is part of simulate) and the largest peak
+        memory (in MB) at the end of the phase.
+    """
+    per_run = df.groupby(['phase', 'dir', 'run'], sort=False).agg(
+        {'seconds': 'sum', 'max_rss': 'max'}).reset_index()
+    grouped = per_run.groupby('phase', sort=False)
+    report = pd.DataFrame({
+        'runs': grouped['run'].count(),
+        'mean_s': grouped['seconds'].mean(),
+        'std_s': grouped['seconds'].std(),
+        'total_s': grouped['seconds'].sum(),
+        'max_rss_mb': grouped['max_rss'].max()/2.**20,
+    }, columns=['runs', 'mean_s', 'std_s', 'total_s', 'max_rss_mb'])
+    report['fraction'] = report['total_s']/report['total_s'].drop(
+        'decode', errors='ignore').sum()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'data_dir', type=str,
+        help="Directory with the results of a run or sweep")
+    parser.add_argument(
+        '--by-dir', action='store_true',
+        help="Report every sub-directory (sweep point) separately")
+    args = parser.parse_args()
+
+    df = load_phases(args.data_dir)
+    if len(df) == 0:
+        print('No phase records in', args.data_dir)
+        sys.exit(1)
+
+    if args.by_dir:
+        for name, group in df.groupby('dir'):
+            print(name)
+            print(phase_report(group).to_string(float_format='%.3f'))
+            print()
+    else:
+        print(phase_report(df).to_string(float_format='%.3f'))
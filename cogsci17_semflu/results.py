@@ -0,0 +1,300 @@
+"""
+Append-only columnar store for the results of SemFlu runs.
+
+pytry writes every run to its own text file, which has to be parsed in full
+to get at any of its values. The store keeps the parameters and results of
+all runs of a sweep column by column instead, so that selected columns of
+selected runs can be read without touching the rest.
+
+A store is a directory with one partition (sub-directory) per writing process
+(and schema). A partition has a file per column to which the values of every
+appended row are added at the end:
+
+    <column>.bin   the values
+    <column>.len   for strings and lists, the length of every row's value
+    rows           one byte per completely written row
+    schema.json    the columns and their kinds
+
+Only the first ``len(rows)`` values of a column are read, so a row that was
+being written when a process was killed is ignored. Column kinds are 'int',
+'float', 'bool', 'str' and the lists 'int[]', 'float[]' and 'str[]' (whose
+strings must not contain newlines).
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+store_name = 'results.store'
+
+dtypes = {'int': '<i8', 'float': '<f8', 'bool': '|u1'}
+
+# kinds of the SemFlu results, the lists may be empty
+semflu_kinds = {'responses': 'str[]', 'irt': 'float[]'}
+
+# partitions opened by this process, by store path and schema
+_partitions = {}
+
+
+def split_batches(results):
+    """Splits the results of batched runs (SemFlu with batch > 1) into one
+    result per seed."""
+    split = []
+    for result in results:
+        if 'seeds' not in result:
+            split.append(result)
+            continue
+        for seed, responses, irt in zip(
+                result['seeds'], result['responses'], result['irt']):
+            single = dict(result, seed=seed, responses=responses, irt=irt)
+            del single['seeds']
+            split.append(single)
+    return split
+
+
+def value_kind(value):
+    """Returns the column kind for `value` (lists default to 'float[]' if
+    they are empty)."""
+    if isinstance(value, (bool, np.bool_)):
+        return 'bool'
+    if isinstance(value, (int, np.integer)):
+        return 'int'
+    if isinstance(value, (float, np.floating)):
+        return 'float'
+    if isinstance(value, (str, type(u''))):
+        return 'str'
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if len(value) == 0:
+            return 'float[]'
+        return value_kind(value[0]) + '[]'
+    raise TypeError("Cannot store values of type {}.".format(type(value)))
+
+
+def _encode(kind, values):
+    """Returns (data, lengths) with the bytes of the values of a column and
+    the lengths of the values (None for fixed size kinds)."""
+    if kind in dtypes:
+        return np.asarray(values, dtype=dtypes[kind]).tobytes(), None
+    if kind == 'str':
+        encoded = [v.encode('utf-8') for v in values]
+        return b''.join(encoded), [len(e) for e in encoded]
+    if kind == 'str[]':
+        encoded = [u'\n'.join(v).encode('utf-8') for v in values]
+        return b''.join(encoded), [len(e) for e in encoded]
+    dtype = dtypes[kind[:-2]]
+    return (np.concatenate([np.zeros(0, dtype=dtype)] + [
+        np.asarray(v, dtype=dtype) for v in values]).tobytes(),
+        [len(v) for v in values])
+
+
+def _append(filename, data):
+    with open(filename, 'ab') as f:
+        f.write(data)
+
+
+def _new_partition(path, schema):
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+    name = 'part-{}-{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+    part = os.path.join(path, name)
+    os.mkdir(part)
+    with open(os.path.join(part, 'schema.json'), 'w') as f:
+        json.dump(dict(columns=schema), f, indent=1)
+    open(os.path.join(part, 'rows'), 'wb').close()
+    return part
+
+
+def append_rows(path, rows, kinds=None):
+    """Appends rows (dicts mapping columns to values) to the store `path`.
+
+    Rows are written to a partition of the calling process; a new partition
+    is started whenever the columns or their kinds change.
+
+    Parameters
+    ----------
+    path : str
+        Store directory, created if necessary.
+    rows : sequence of dict
+        Rows to append.
+    kinds : dict, optional
+        Kinds of columns that should not be inferred from the values, e.g.
+        'str[]' for lists that may be empty.
+    """
+    kinds = kinds or {}
+    groups = []
+    for row in rows:
+        schema = [[k, kinds.get(k) or value_kind(v)]
+                  for k, v in sorted(row.items())]
+        if len(groups) > 0 and groups[-1][0] == schema:
+            groups[-1][1].append(row)
+        else:
+            groups.append((schema, [row]))
+
+    for schema, group in groups:
+        key = (os.getpid(), os.path.abspath(path), json.dumps(schema))
+        if key not in _partitions:
+            _partitions[key] = _new_partition(path, schema)
+        part = _partitions[key]
+
+        for column, kind in schema:
+            data, lengths = _encode(kind, [row[column] for row in group])
+            filename = os.path.join(part, column)
+            _append(filename + '.bin', data)
+            if lengths is not None:
+                _append(filename + '.len',
+                        np.asarray(lengths, dtype='<i8').tobytes())
+        # the rows are complete only now
+        _append(os.path.join(part, 'rows'), b'\x01'*len(group))
+
+
+def _read_column(part, column, kind, n, mask):
+    """Reads the first `n` values of a column of a partition, restricted to
+    the rows where `mask` is True (all rows if None)."""
+    filename = os.path.join(part, column)
+    if kind in dtypes:
+        values = np.fromfile(filename + '.bin', dtype=dtypes[kind], count=n)
+        if kind == 'bool':
+            values = values.astype(bool)
+        return values if mask is None else values[mask]
+
+    lengths = np.fromfile(filename + '.len', dtype='<i8', count=n)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    if mask is not None:
+        starts, ends = starts[mask], ends[mask]
+
+    if kind in ('str', 'str[]'):
+        with open(filename + '.bin', 'rb') as f:
+            data = f.read(int(np.sum(lengths)))
+        strings = [data[s:e].decode('utf-8') for s, e in zip(starts, ends)]
+        if kind == 'str':
+            return np.array(strings, dtype=object)
+        return np.array(
+            [s.split(u'\n') if len(s) > 0 else [] for s in strings] + [None],
+            dtype=object)[:-1]
+
+    data = np.fromfile(
+        filename + '.bin', dtype=dtypes[kind[:-2]], count=int(np.sum(lengths)))
+    return np.array(
+        [data[s:e].tolist() for s, e in zip(starts, ends)] + [None],
+        dtype=object)[:-1]
+
+
+def partitions(path):
+    """Returns the partition directories of the store `path`."""
+    if not os.path.isdir(path):
+        return []
+    return [os.path.join(path, p) for p in sorted(os.listdir(path))
+            if os.path.exists(os.path.join(path, p, 'schema.json'))]
+
+
+def read_rows(path, columns=None, seeds=None, **params):
+    """Reads rows of the store `path`.
+
+    Only the files of the requested columns and of the columns that are
+    filtered on are read.
+
+    Parameters
+    ----------
+    path : str
+        Store directory.
+    columns : sequence of str, optional
+        Columns to read, all by default.
+    seeds : sequence of int, optional
+        Only read rows with these seeds.
+    params : dict
+        Only read rows where these columns have the given values (rows of
+        partitions without such a column do not match).
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    frames = []
+    all_columns = []
+    for part in partitions(path):
+        with open(os.path.join(part, 'schema.json'), 'r') as f:
+            schema = dict((k, kind) for k, kind in json.load(f)['columns'])
+        n = os.path.getsize(os.path.join(part, 'rows'))
+        all_columns.extend(k for k in sorted(schema) if k not in all_columns)
+
+        filtered = list(params) + (['seed'] if seeds is not None else [])
+        if n == 0 or any(k not in schema for k in filtered):
+            continue
+
+        mask = None
+        if len(filtered) > 0:
+            mask = np.ones(n, dtype=bool)
+            for k, v in params.items():
+                mask &= _read_column(part, k, schema[k], n, None) == v
+            if seeds is not None:
+                mask &= np.in1d(
+                    _read_column(part, 'seed', schema['seed'], n, None),
+                    np.asarray(list(seeds), dtype=int))
+            if not np.any(mask):
+                continue
+
+        wanted = sorted(schema) if columns is None else columns
+        frames.append(pd.DataFrame({
+            k: _read_column(part, k, schema[k], n, mask)
+            for k in wanted if k in schema}))
+
+    wanted = all_columns if columns is None else list(columns)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=wanted)
+    df = pd.concat(frames, ignore_index=True)
+    return df.reindex(columns=wanted)
+
+
+def append_trial(path, trial, p, result, kinds=semflu_kinds):
+    """Appends the parameters `p` and the `result` of a run of the pytry
+    `trial` to the store `path`, one row per seed. The run is identified by
+    its data filename in the column 'run'."""
+    row = {k: getattr(p, k) for k in trial.param_defaults
+           if k not in trial.system_params}
+    row.update(result)
+    row['run'] = p.data_filename
+    append_rows(path, split_batches([row]), kinds=kinds)
+
+
+def import_pytry(data_path, path, kinds=semflu_kinds):
+    """Appends the pytry results in `data_path` to the store `path`, e.g. to
+    analyse runs from before the store was used. Batched runs are split into
+    one row per seed.
+
+    Returns
+    -------
+    int
+        Number of appended rows.
+    """
+    import pytry
+
+    rows = split_batches(pytry.read(data_path))
+    append_rows(path, rows, kinds=kinds)
+    return len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Imports pytry results into a results store")
+    parser.add_argument('data_dir', type=str, help="Directory with results")
+    parser.add_argument(
+        'store', nargs='?', type=str, default=None,
+        help="Store directory (default: {} in data_dir)".format(store_name))
+    args = parser.parse_args()
+
+    store = args.store or os.path.join(args.data_dir, store_name)
+    n = import_pytry(args.data_dir, store)
+    print('Imported', n, 'runs from', args.data_dir, 'into', store)
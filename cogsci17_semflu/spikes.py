@@ -0,0 +1,223 @@
+"""
+Recording of spikes to disk while a model is simulated, and lazy reading of
+the recorded spikes.
+
+Spikes are stored as sparse (timestep, neuron) events in a zip file. The
+events are written in chunks of a fixed number of timesteps, each chunk as a
+separate compressed member, so that memory use does not grow with the length
+of the simulation and a time window can be read without loading the whole
+file.
+"""
+
+import io
+import zipfile
+
+import numpy as np
+
+
+def _write_array(zf, name, array):
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, np.asarray(array))
+    zf.writestr(name + '.npy', buf.getvalue())
+
+
+def _read_array(zf, name):
+    return np.lib.format.read_array(io.BytesIO(zf.read(name + '.npy')))
+
+
+def _chunk_name(i):
+    return 'chunk_{:06d}'.format(i)
+
+
+class SpikeRecorder(object):
+    """Writes spikes to `filename` while the model is simulated.
+
+    Used as the function of a nengo.Node that receives the neuron outputs of
+    all recorded groups (with ``synapse=None``), see `connect`. Call `close`
+    after the simulation to write the remaining events.
+
+    Parameters
+    ----------
+    filename : str
+        File to write to.
+    groups : sequence of (str, int)
+        Names and number of neurons of the recorded groups, in the order in
+        which they are concatenated in the node input.
+    dt : float
+        Simulation timestep.
+    chunk_steps : int, optional
+        Number of timesteps per chunk.
+    """
+
+    def __init__(self, filename, groups, dt, chunk_steps=1000):
+        self.filename = filename
+        self.names = [name for name, _ in groups]
+        self.sizes = [n for _, n in groups]
+        self.size_in = sum(self.sizes)
+        self.dt = dt
+        self.chunk_steps = chunk_steps
+
+        self.zf = zipfile.ZipFile(
+            filename, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.chunk = 0
+        self.n_steps = 0
+        self.steps = []
+        self.neurons = []
+
+    @classmethod
+    def connect(cls, filename, groups, dt, chunk_steps=1000):
+        """Creates the recorder and its node in the current network.
+
+        Parameters
+        ----------
+        groups : sequence of (str, sequence of nengo.Ensemble)
+            Names of the groups and the ensembles whose spikes are recorded.
+
+        Returns
+        -------
+        SpikeRecorder
+        """
+        import nengo
+
+        ensembles = [(name, list(ens)) for name, ens in groups]
+        recorder = cls(
+            filename, [(name, sum(e.n_neurons for e in ens))
+                       for name, ens in ensembles], dt, chunk_steps)
+        node = nengo.Node(recorder, size_in=recorder.size_in)
+
+        offset = 0
+        for _, ens in ensembles:
+            for e in ens:
+                nengo.Connection(
+                    e.neurons, node[offset:offset+e.n_neurons], synapse=None)
+                offset += e.n_neurons
+        return recorder
+
+    def __call__(self, t, x):
+        step = int(np.round(t/self.dt)) - 1
+        neurons = np.flatnonzero(x)
+        if len(neurons) > 0:
+            self.steps.append(np.full(len(neurons), step, dtype=np.int32))
+            self.neurons.append(neurons.astype(np.int32))
+        self.n_steps = step + 1
+        if self.n_steps >= (self.chunk + 1)*self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered events as the next chunk."""
+        if len(self.steps) > 0:
+            events = np.column_stack(
+                [np.concatenate(self.steps), np.concatenate(self.neurons)])
+        else:
+            events = np.zeros((0, 2), dtype=np.int32)
+        _write_array(self.zf, _chunk_name(self.chunk), events)
+        self.chunk += 1
+        self.steps = []
+        self.neurons = []
+
+    def close(self, **arrays):
+        """Writes the remaining events and closes the file.
+
+        Further arrays given as keyword arguments (e.g. decoded values) are
+        stored in the file as well.
+        """
+        if self.n_steps > self.chunk*self.chunk_steps:
+            self.flush()
+        _write_array(self.zf, 'names', np.array(self.names))
+        _write_array(self.zf, 'sizes', np.array(self.sizes))
+        _write_array(self.zf, 'info', np.array(
+            [self.dt, self.chunk_steps, self.n_steps, self.chunk]))
+        for name, array in arrays.items():
+            _write_array(self.zf, name, array)
+        self.zf.close()
+
+
+class SpikeFile(object):
+    """Lazy reader for files written by SpikeRecorder.
+
+    Only the chunks that overlap a requested time window are decompressed.
+    """
+
+    def __init__(self, filename):
+        self.zf = zipfile.ZipFile(filename, 'r')
+        self.names = [str(name) for name in _read_array(self.zf, 'names')]
+        self.sizes = _read_array(self.zf, 'sizes').astype(int)
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)])
+        dt, chunk_steps, n_steps, n_chunks = _read_array(self.zf, 'info')
+        self.dt = float(dt)
+        self.chunk_steps = int(chunk_steps)
+        self.n_steps = int(n_steps)
+        self.n_chunks = int(n_chunks)
+
+    def __getitem__(self, name):
+        """Returns another array stored in the file, e.g. ``cue_decoded``."""
+        return _read_array(self.zf, name)
+
+    def close(self):
+        self.zf.close()
+
+    def n_neurons(self, group=None):
+        if group is None:
+            return int(self.offsets[-1])
+        return int(self.sizes[self.names.index(group)])
+
+    def _steps(self, t0, t1):
+        step0 = max(int(np.round(t0/self.dt)), 0)
+        step1 = self.n_steps if t1 is None else min(
+            int(np.round(t1/self.dt)), self.n_steps)
+        return step0, step1
+
+    def _events(self, step0, step1, group):
+        """Yields the (step, neuron) events of every chunk that overlaps the
+        steps [step0, step1), restricted to these steps and to `group`."""
+        if group is None:
+            lo, hi = 0, self.offsets[-1]
+        else:
+            g = self.names.index(group)
+            lo, hi = self.offsets[g], self.offsets[g+1]
+
+        first = step0//self.chunk_steps
+        last = min(-(-step1//self.chunk_steps), self.n_chunks)
+        for i in range(first, last):
+            events = _read_array(self.zf, _chunk_name(i))
+            keep = ((events[:, 0] >= step0) & (events[:, 0] < step1) &
+                    (events[:, 1] >= lo) & (events[:, 1] < hi))
+            yield events[keep] - [0, lo]
+
+    def window(self, t0=0., t1=None, group=None):
+        """Returns the spikes in the time window [t0, t1).
+
+        Returns
+        -------
+        tuple
+            (times, neurons) with the spike times in seconds and the indices
+            of the spiking neurons (within `group` if given).
+        """
+        step0, step1 = self._steps(t0, t1)
+        events = np.concatenate(
+            [np.zeros((0, 2), dtype=int)] +
+            list(self._events(step0, step1, group)))
+        return (events[:, 0] + 1)*self.dt, events[:, 1]
+
+    def rates(self, bin_size, t0=0., t1=None, group=None):
+        """Returns the firing rates in bins of `bin_size` seconds.
+
+        The file is read chunk by chunk, so the rates of a long recording can
+        be computed without loading all spikes at once.
+
+        Returns
+        -------
+        tuple
+            (t, rates) with the start time of every bin and an array of shape
+            (bins, neurons) with the firing rates in Hz.
+        """
+        step0, step1 = self._steps(t0, t1)
+        bin_steps = max(int(np.round(bin_size/self.dt)), 1)
+        n_bins = max(-(-(step1 - step0)//bin_steps), 0)
+
+        counts = np.zeros((n_bins, self.n_neurons(group)))
+        for events in self._events(step0, step1, group):
+            bins = (events[:, 0] - step0)//bin_steps
+            np.add.at(counts, (bins, events[:, 1]), 1)
+        t = (step0 + bin_steps*np.arange(n_bins))*self.dt
+        return t, counts/(bin_steps*self.dt)
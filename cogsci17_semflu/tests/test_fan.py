@@ -0,0 +1,26 @@
+import pytest
+
+from cogsci17_semflu import fan
+
+
+def write_fan_file(tmpdir, rows):
+    path = tmpdir.join('Cue_Target_Pairs.A-B')
+    path.write('CUE, TARGET, NORMED?, FSG\n' + ''.join(
+        '{}, {}, {}, {}\n'.format(*row) for row in rows))
+    return str(path)
+
+
+def test_parse_free_association_file_sanitizes_words(tmpdir):
+    filename = write_fan_file(tmpdir, [
+        ('ice cream', 'hot-dog', 'YES', 0.1), ('a', 'b', 'NO', 0.2)])
+    cues, targets, strengths = fan.parse_free_association_file(
+        (filename, 'FSG'))
+    assert list(cues) == ['ICE_CREAM']
+    assert list(targets) == ['HOT_DOG']
+    assert list(strengths) == [0.1]
+
+
+def test_parse_free_association_file_missing_cue(tmpdir):
+    filename = write_fan_file(tmpdir, [('', 'dog', 'YES', 0.1)])
+    with pytest.raises(TypeError):
+        fan.parse_free_association_file((filename, 'FSG'))
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from cogsci17_semflu import process_responses as pr
+
+
+def synthetic_categories(n_animals=10, n_categories=5, rng=np.random):
+    """Category dicts like the ones of scripts/categorize_animals.py, every
+    animal belonging to one to three random categories."""
+    categories = ['cat{}'.format(i) for i in range(n_categories)]
+    animal_to_category = {}
+    for i in range(n_animals):
+        n = rng.randint(1, 4)
+        animal_to_category['animal{}'.format(i)] = [
+            categories[c] for c in sorted(
+                rng.choice(n_categories, n, replace=False))]
+    category_to_animal = {cat: [] for cat in categories}
+    for animal, cats in sorted(animal_to_category.items()):
+        for cat in cats:
+            category_to_animal[cat].append(animal)
+    return category_to_animal, animal_to_category
+
+
+def exhaustive_segmentation(cat_matrix):
+    """Best of all segmentations of cat_mat_sol: the fewest rows used, then
+    the most entries, the first one found on ties."""
+    solutions = pr.cat_mat_sol(0, np.zeros(cat_matrix.shape), cat_matrix)
+
+    best_val = 0
+    best_index = -1
+    for i, s in enumerate(solutions):
+        score = (s.shape[0] - np.count_nonzero(np.sum(s, axis=1)))*1000000 \
+            + np.sum(s)
+        if score > best_val:
+            best_val = score
+            best_index = i
+    return solutions[best_index]
+
+
+@pytest.mark.parametrize('length', range(1, 9))
+def test_optimal_segmentation(length):
+    rng = np.random.RandomState(length)
+    for _ in range(50):
+        category_to_animal, animal_to_category = synthetic_categories(
+            rng=rng)
+        sp_list = list(rng.choice(
+            sorted(animal_to_category), length, replace=True))
+        cat_matrix = pr.build_categorization_matrix(
+            sp_list, animal_to_category, category_to_animal)
+
+        assert np.array_equal(
+            pr.optimal_segmentation(cat_matrix),
+            exhaustive_segmentation(cat_matrix))
+
+
+def test_optimal_segmentation_random_matrices():
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        cat_matrix = (rng.rand(rng.randint(1, 5), rng.randint(1, 8)) <
+                      0.4).astype(float)
+        cat_matrix[rng.randint(cat_matrix.shape[0], size=cat_matrix.shape[1]),
+                   np.arange(cat_matrix.shape[1])] = 1
+        cat_matrix = pr.unfold(cat_matrix)
+
+        assert np.array_equal(
+            pr.optimal_segmentation(cat_matrix),
+            exhaustive_segmentation(cat_matrix))
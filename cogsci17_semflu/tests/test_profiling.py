@@ -0,0 +1,23 @@
+import os
+
+import numpy as np
+
+from cogsci17_semflu import profiling
+
+
+def test_write_and_load_phases(tmpdir):
+    timer = profiling.PhaseTimer()
+    with timer.phase('build'):
+        pass
+    timer.add('decode', np.float64(0.5))
+
+    run_dir = tmpdir.mkdir('point')
+    filename = os.path.join(str(run_dir), 'run' + profiling.phases_suffix)
+    # nengo's Simulator.time is a 0-d array
+    timer.write(filename, seed=np.int64(3), batch=1, stop_time=np.array(5.))
+
+    df = profiling.load_phases(str(tmpdir))
+    assert list(df['phase']) == ['build', 'decode']
+    assert list(df['dir']) == ['point', 'point']
+    assert list(df['run']) == ['run', 'run']
+    assert df['seconds'].iloc[1] == 0.5
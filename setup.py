@@ -7,6 +7,7 @@ setup(
     install_requires=[
         'nengo',
         'numpy',
+        'scipy',
         'matplotlib',
         'pytry'
     ]